@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Admission control of requests, sheds load before it piles up inside the application"""
+import json
+import math
+import threading
+import time
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import ClosingIterator
+
+
+class EndpointClass(object):
+    """Limit of requests in flight of a class of endpoints, with a queue where requests wait until deadline"""
+
+    def __init__(self, name, limit, queue_timeout, queue_size=None):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.queue_size = limit * 4 if queue_size is None else queue_size
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._condition = threading.Condition()
+
+    def enter(self):
+        """Take a slot, waiting up to queue timeout, return False when request must be shed"""
+        with self._condition:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self.shed += 1
+                    return False
+
+                deadline = time.monotonic() + self.queue_timeout
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.shed += 1
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def leave(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        return {'limit': self.limit, 'in_flight': self.in_flight, 'waiting': self.waiting,
+                'admitted': self.admitted, 'shed': self.shed}
+
+
+class AdmissionMiddleware(object):
+    """WSGI middleware of an app capping requests in flight by class of endpoint.
+
+    Classes are `hash` (login and change password), `admin` and `read` (everything else). A request
+    waits in queue while its class is full, and after queue timeout it gets a 503 with Retry-After.
+    """
+    hash_paths = ('/login', '/change_password')
+
+    def __init__(self, wsgi_app, limits):
+        self.wsgi_app = wsgi_app
+        self.classes = dict((name, EndpointClass(name, *limit)) for name, limit in limits.items())
+
+    def classify(self, path):
+        if path in self.hash_paths:
+            return self.classes.get('hash')
+        if path == '/admin' or path.startswith('/admin/'):
+            return self.classes.get('admin')
+        return self.classes.get('read')
+
+    def __call__(self, environ, start_response):
+        endpoint_class = self.classify(environ.get('PATH_INFO', ''))
+        if endpoint_class is None:
+            return self.wsgi_app(environ, start_response)
+
+        if not endpoint_class.enter():
+            return self.shed(endpoint_class, environ, start_response)
+
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            endpoint_class.leave()
+            raise
+        # Slot is released when server closes response, streamed responses keep it until the end
+        return ClosingIterator(response, [endpoint_class.leave])
+
+    @staticmethod
+    def shed(endpoint_class, environ, start_response):
+        retry_after = max(int(math.ceil(endpoint_class.queue_timeout)), 1)
+        response = Response(json.dumps({'error_code': 'service_unavailable'}), status=503,
+                            mimetype='application/json', headers={'Retry-After': str(retry_after)})
+        return response(environ, start_response)
+
+    def stats(self):
+        return dict((name, endpoint_class.stats()) for name, endpoint_class in self.classes.items())
+
+
+class AdmissionController(object):
+    """Extension wrapping each app in its own `AdmissionMiddleware`, kept in `app.extensions['admission']`"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        limits = app.config.get('ADMISSION_LIMITS')
+        if not limits:
+            return
+
+        middleware = AdmissionMiddleware(app.wsgi_app, limits)
+        app.wsgi_app = middleware
+        app.extensions['admission'] = middleware
+
+
+admission = AdmissionController()
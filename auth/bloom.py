@@ -0,0 +1,134 @@
+# coding: utf-8
+"""Probabilistic filter of known usernames and emails"""
+import hashlib
+import math
+import threading
+from sqlalchemy import func
+
+
+class BloomFilter(object):
+    """Bloom filter sized for `capacity` values with `error_rate` of false positives"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class LoginFilter(object):
+    """Filter of usernames and emails of all users.
+
+    It's built from database at first use and updated by each inserted user. Before answering that a
+    value is missing, it loads users changed by other workers, received through invalidation bus, and
+    users inserted with ids above the highest id it knows, so users written by other processes are
+    found even before their message arrives. Usernames and emails changed by other processes are only
+    known through invalidation bus, filter needs a transport shared by all workers.
+    """
+
+    def __init__(self, app=None):
+        self.capacity = 0
+        self.error_rate = 0.001
+        self.bloom = None
+        self.last_id = 0
+        self.pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.capacity = app.config.get('LOGIN_FILTER_CAPACITY', 0)
+        self.error_rate = app.config.get('LOGIN_FILTER_ERROR_RATE', self.error_rate)
+        self.reset()
+        self.pending = set()
+
+    @property
+    def enabled(self):
+        return bool(self.capacity)
+
+    def might_contain(self, value):
+        """Return False only when value is not a username or email of any user known by filter"""
+        if not self.enabled:
+            return True
+
+        bloom = self._bloom()
+        if value in bloom:
+            return True
+
+        self._catch_up()
+        return value in self._bloom()
+
+    def add(self, *values):
+        bloom = self.bloom
+        if bloom is None:
+            return
+
+        for value in values:
+            if value:
+                bloom.add(value)
+        if bloom.count > bloom.capacity:
+            # Too many values for its size, it's rebuilt bigger at next use
+            self.reset()
+
+    def on_change(self, kind, key_id):
+        """Handler of invalidation bus"""
+        if kind == 'user' and self.enabled:
+            self.pending.add(key_id)
+
+    def reset(self):
+        self.bloom = None
+        self.last_id = 0
+
+    def _bloom(self):
+        if self.bloom is None:
+            with self._lock:
+                if self.bloom is None:
+                    self.bloom = self._build()
+        return self.bloom
+
+    def _build(self):
+        from auth.models import User
+        total = User.query.fast_count()
+        bloom = BloomFilter(max(self.capacity, total * 4), self.error_rate)
+        last_id = 0
+        for user_id, username, email in User.query.with_entities(User.id, User.username, User.email).yield_per(10000):
+            for value in (username, email):
+                if value:
+                    bloom.add(value)
+            last_id = max(last_id, user_id)
+        self.last_id = last_id
+        return bloom
+
+    def _catch_up(self):
+        """Load users changed by other workers and users inserted after the highest id known by filter"""
+        from auth.models import db, User
+        if self.pending:
+            user_ids, self.pending = self.pending, set()
+            self._load(User.id.in_(user_ids))
+
+        last_id = db.session.query(func.max(User.id)).scalar() or 0
+        if last_id > self.last_id:
+            self._load(User.id > self.last_id)
+            self.last_id = max(self.last_id, last_id)
+
+    def _load(self, condition):
+        from auth.models import User
+        for username, email in User.query.with_entities(User.username, User.email).filter(condition):
+            self.add(username, email)
+
+
+login_filter = LoginFilter()
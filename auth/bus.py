@@ -0,0 +1,318 @@
+# coding: utf-8
+"""Broadcast of changed users and roles, so every worker evicts its caches"""
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from flask_sqlalchemy import models_committed
+
+logger = logging.getLogger(__name__)
+
+
+def encode_keys(keys):
+    return ','.join('{}:{}'.format(kind, key_id) for kind, key_id in sorted(keys))
+
+
+def decode_keys(payload):
+    keys = set()
+    for item in payload.split(','):
+        kind, _, key_id = item.partition(':')
+        if kind and key_id.isdigit():
+            keys.add((kind, int(key_id)))
+    return keys
+
+
+class MemoryTransport(object):
+    """Deliver keys to other buses in this process sharing the same channel, used in tests and single process"""
+    channels = {}
+
+    def __init__(self, channel='default'):
+        self.channel = channel
+        self.receiver = None
+
+    def start(self, receiver, reset=None):
+        self.receiver = receiver
+        self.channels.setdefault(self.channel, []).append(self)
+
+    def send(self, keys):
+        for transport in list(self.channels.get(self.channel, ())):
+            if transport is not self:
+                transport.receiver(keys)
+
+    def stop(self):
+        transports = self.channels.get(self.channel, [])
+        if self in transports:
+            transports.remove(self)
+
+
+class UnixSocketTransport(object):
+    """Deliver keys to all processes of this host with a datagram socket in `directory`"""
+    max_size = 4096
+
+    def __init__(self, directory, name=None):
+        self.directory = directory
+        self.path = os.path.join(directory, '{}.sock'.format(name or os.getpid()))
+        self.socket = None
+        self.receiver = None
+
+    def start(self, receiver, reset=None):
+        self.receiver = receiver
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        thread = threading.Thread(target=self._listen, name='invalidation-bus', daemon=True)
+        thread.start()
+
+    def send(self, keys):
+        for payload in split_payload(encode_keys(keys), self.max_size):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith('.sock') or path == self.path:
+                    continue
+                try:
+                    self.socket.sendto(payload.encode('ascii'), path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Process is gone, its socket is left behind
+                    self._unlink(path)
+                except OSError:
+                    logger.exception('Could not send invalidation to %s', path)
+
+    def stop(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self._unlink(self.path)
+
+    def _listen(self):
+        while self.socket is not None:
+            try:
+                payload = self.socket.recv(self.max_size)
+            except OSError:
+                return
+            self.receiver(decode_keys(payload.decode('ascii')))
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class PostgresTransport(object):
+    """Deliver keys to all processes connected to database with LISTEN/NOTIFY.
+
+    A lost connection is opened again with backoff, then `reset` is called since messages sent
+    meanwhile were missed.
+    """
+    max_size = 7999
+    min_delay = 1
+    max_delay = 30
+
+    def __init__(self, dsn, channel='flapy_auth_invalidation'):
+        self.dsn = dsn
+        self.channel = channel
+        self.connection = None
+        self.receiver = None
+        self.reset = None
+        self.running = False
+        self._lock = threading.Lock()
+
+    def start(self, receiver, reset=None):
+        self.receiver = receiver
+        self.reset = reset
+        self.running = True
+        self._connect()
+        thread = threading.Thread(target=self._listen, name='invalidation-bus', daemon=True)
+        thread.start()
+
+    def send(self, keys):
+        with self._lock:
+            if self.connection is None:
+                raise ConnectionError('Invalidation bus is not connected to database')
+            with self.connection.cursor() as cursor:
+                for payload in split_payload(encode_keys(keys), self.max_size):
+                    cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, payload))
+
+    def stop(self):
+        self.running = False
+        self._disconnect()
+
+    def _connect(self):
+        import psycopg2
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN {}'.format(self.channel))
+        with self._lock:
+            self.connection = connection
+
+    def _disconnect(self):
+        with self._lock:
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _listen(self):
+        while self.running:
+            try:
+                self._receive()
+            except Exception:
+                if not self.running:
+                    return
+                logger.exception('Invalidation bus lost connection to database')
+            self._disconnect()
+            self._reconnect()
+
+    def _receive(self):
+        connection = self.connection
+        own_pid = connection.get_backend_pid()
+        while self.running:
+            if select.select([connection], [], [], 5) == ([], [], []):
+                continue
+            with self._lock:
+                connection.poll()
+                notifies = connection.notifies[:]
+                del connection.notifies[:]
+            for notify in notifies:
+                if notify.pid != own_pid:
+                    self.receiver(decode_keys(notify.payload))
+
+    def _reconnect(self):
+        delay = self.min_delay
+        while self.running:
+            time.sleep(delay)
+            try:
+                self._connect()
+            except Exception:
+                logger.warning('Invalidation bus could not connect to database, next try in %s seconds', delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            if self.reset is not None:
+                self.reset()
+            return
+
+
+def split_payload(payload, max_size):
+    """Split a comma separated payload in chunks not bigger than max_size"""
+    chunk = ''
+    for item in payload.split(','):
+        if chunk and len(chunk) + len(item) + 1 > max_size:
+            yield chunk
+            chunk = ''
+        chunk = '{},{}'.format(chunk, item) if chunk else item
+    if chunk:
+        yield chunk
+
+
+class InvalidationBus(object):
+    """Publish keys of changed entities, as (kind, id), to handlers of all workers.
+
+    Handlers are called with kind ('user' or 'role') and id, in this process right away and in
+    other processes when transport delivers the message. Reset handlers are called without arguments
+    when messages may have been missed, and must forget everything cached.
+
+    Transport is started at first request or publish, so each forked worker has its own socket or
+    connection, even when app is created before fork.
+    """
+
+    def __init__(self, app=None):
+        self.config = None
+        self.transport = None
+        self.handlers = []
+        self.reset_handlers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.transport is not None and self._pid == os.getpid():
+            self.transport.stop()
+        self.transport = None
+        self.config = app.config
+        models_committed.connect(self.on_models_committed, sender=app)
+        app.before_request(self.start)
+
+    def start(self):
+        """Start transport of this process, when it's not started yet"""
+        if self.config is None or (self.transport is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self.transport is None or self._pid != os.getpid():
+                # A transport inherited from parent process is left to it
+                transport = self.create_transport(self.config)
+                transport.start(self.dispatch, self.reset)
+                self.transport, self._pid = transport, os.getpid()
+
+    @staticmethod
+    def create_transport(config):
+        name = config.get('INVALIDATION_TRANSPORT') or 'memory'
+        if name == 'memory':
+            return MemoryTransport(config.get('INVALIDATION_CHANNEL', 'default'))
+        if name == 'unix':
+            return UnixSocketTransport(config['INVALIDATION_SOCKET_DIR'])
+        if name == 'postgres':
+            return PostgresTransport(config.get('INVALIDATION_DSN') or config['SQLALCHEMY_DATABASE_URI'],
+                                     config.get('INVALIDATION_CHANNEL', 'flapy_auth_invalidation'))
+        raise ValueError('Unknown invalidation transport {!r}'.format(name))
+
+    def subscribe(self, handler):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+        return handler
+
+    def subscribe_reset(self, handler):
+        if handler not in self.reset_handlers:
+            self.reset_handlers.append(handler)
+        return handler
+
+    def reset(self):
+        for handler in self.reset_handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception('Invalidation reset handler failed')
+
+    def publish(self, users=(), roles=()):
+        keys = set(('user', user_id) for user_id in users) | set(('role', role_id) for role_id in roles)
+        if not keys:
+            return
+
+        self.dispatch(keys)
+        self.start()
+        if self.transport is not None:
+            try:
+                self.transport.send(keys)
+            except Exception:
+                logger.exception('Could not publish invalidation of %s', encode_keys(keys))
+
+    def dispatch(self, keys):
+        for kind, key_id in keys:
+            for handler in self.handlers:
+                try:
+                    handler(kind, key_id)
+                except Exception:
+                    logger.exception('Invalidation handler failed for %s:%s', kind, key_id)
+
+    def on_models_committed(self, sender, changes):
+        from auth.models import User, Role, UserRole
+        users, roles = set(), set()
+        for model, operation in changes:
+            if isinstance(model, User):
+                users.add(model.id)
+            elif isinstance(model, Role):
+                roles.add(model.id)
+            elif isinstance(model, UserRole):
+                users.add(model.user_id)
+        self.publish(users=users - {None}, roles=roles - {None})
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""In-process caches used to avoid repeated queries"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class PermissionCache(object):
+    """LRU cache of role names by user id, with a time to live for each entry.
+
+    Each entry keeps the ids of the cached roles, so a change in one role only
+    evicts the users that hold it.
+    """
+
+    def __init__(self, app=None, size=10000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._role_users = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config.get('PERMISSION_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('PERMISSION_CACHE_TTL', self.ttl)
+        self.clear()
+
+    @property
+    def enabled(self):
+        """Return True when cache can keep any entry"""
+        return bool(self.size and self.ttl)
+
+    def get(self, user_id):
+        """Return a frozenset of role names of user, or None if not cached"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires_at, names, role_ids = entry
+            if expires_at < time.monotonic():
+                self._evict(user_id)
+                return None
+
+            self._entries.move_to_end(user_id)
+            return names
+
+    def set(self, user_id, roles):
+        """Cache roles of user, `roles` is an iterable of (role_id, role_name)"""
+        roles = list(roles)
+        names = frozenset(name for _, name in roles)
+        if not self.enabled:
+            return names
+
+        role_ids = frozenset(role_id for role_id, _ in roles)
+        with self._lock:
+            self._evict(user_id)
+            self._entries[user_id] = (time.monotonic() + self.ttl, names, role_ids)
+            for role_id in role_ids:
+                self._role_users.setdefault(role_id, set()).add(user_id)
+
+            while len(self._entries) > self.size:
+                self._evict(next(iter(self._entries)))
+        return names
+
+    def invalidate_user(self, user_id):
+        """Remove cached roles of a user"""
+        with self._lock:
+            self._evict(user_id)
+
+    def invalidate_role(self, role_id):
+        """Remove cached roles of all users that hold this role"""
+        with self._lock:
+            for user_id in list(self._role_users.get(role_id, ())):
+                self._evict(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._role_users.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+
+        for role_id in entry[2]:
+            users = self._role_users.get(role_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self._role_users[role_id]
+
+
+class RoleBitCache(object):
+    """Map of role name to the bit slot of role, reloaded after ttl"""
+
+    def __init__(self, app=None, ttl=60):
+        self.ttl = ttl
+        self._bits = None
+        self._expires_at = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PERMISSION_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def get(self, loader):
+        """Return the map, `loader` returns (name, bit) of all roles when it must be reloaded"""
+        bits = self._bits
+        if bits is None or self._expires_at < time.monotonic():
+            bits = dict(loader())
+            self._bits = bits
+            self._expires_at = time.monotonic() + self.ttl
+        return bits
+
+    def clear(self):
+        self._bits = None
+
+
+class CountCache(object):
+    """LRU cache of counts of rows by query, evicted when any table read by query changes or after ttl"""
+
+    def __init__(self, app=None, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config.get('COUNT_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('COUNT_CACHE_TTL', self.ttl)
+        self.clear()
+
+    def get(self, key, tables, loader):
+        """Return count cached by key, `loader` counts when it's missing, `tables` are names of tables read"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[2]
+                del self._entries[key]
+
+        count = loader()
+        if self.size and self.ttl:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, frozenset(tables), count)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return count
+
+    def invalidate(self, *tables):
+        """Remove counts of queries reading any of tables"""
+        tables = set(tables)
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry[1] & tables:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+permission_cache = PermissionCache()
+role_bits = RoleBitCache()
+count_cache = CountCache()
+
+
+def evict(kind, key_id):
+    """Handler of invalidation bus, evicts cached permissions and counts of a changed user or role"""
+    if kind == 'user':
+        permission_cache.invalidate_user(key_id)
+        count_cache.invalidate('user', 'user_role')
+    elif kind == 'role':
+        permission_cache.invalidate_role(key_id)
+        role_bits.clear()
+        count_cache.invalidate('role', 'user_role')
+
+
+def evict_all():
+    """Reset handler of invalidation bus, forgets all cached permissions and counts"""
+    permission_cache.clear()
+    role_bits.clear()
+    count_cache.clear()
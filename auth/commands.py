@@ -0,0 +1,54 @@
+# coding: utf-8
+"""Commands of manage.py"""
+import sys
+from flask_script import Command, Option
+from auth.exporter import export_lines
+from auth.importer import import_file, USERS, USER_ROLES
+from auth.models import User, Role
+
+
+class ImportCommand(Command):
+    """Import users or role memberships (username, role) from a CSV or NDJSON file"""
+
+    option_list = (
+        Option('path', help='CSV with header or NDJSON file'),
+        Option('--kind', '-k', choices=(USERS, USER_ROLES), default=USERS),
+        Option('--format', '-f', dest='file_format', choices=('csv', 'ndjson'), default=None,
+               help='Format of file, guessed by its extension by default'),
+        Option('--chunk-size', '-c', dest='chunk_size', type=int, default=5000),
+        Option('--hash-passwords', dest='hash_passwords', action='store_true', default=False,
+               help='Passwords are plain text and must be hashed'),
+    )
+
+    def run(self, path, kind, file_format, chunk_size, hash_passwords):
+        progress = import_file(path, kind, chunk_size=chunk_size, hash_passwords=hash_passwords,
+                               file_format=file_format, report=self.report)
+        sys.stderr.write('\nDone: {}\n'.format(progress))
+
+    @staticmethod
+    def report(progress):
+        sys.stderr.write('\r{}'.format(progress))
+        sys.stderr.flush()
+
+
+class ExportCommand(Command):
+    """Export users or roles as NDJSON, to a file or to standard output"""
+
+    option_list = (
+        Option('kind', choices=('users', 'roles')),
+        Option('--output', '-o', dest='path', default=None),
+        Option('--chunk-size', '-c', dest='chunk_size', type=int, default=1000),
+        Option('--with-passwords', dest='with_passwords', action='store_true', default=False,
+               help='Keep password hashes, to import users in another database'),
+    )
+
+    def run(self, kind, path, chunk_size, with_passwords):
+        model = User if kind == 'users' else Role
+        exclude = () if with_passwords else ('password',)
+        output = open(path, 'w', encoding='utf-8') if path else sys.stdout
+        try:
+            for line in export_lines(model, exclude=exclude, chunk_size=chunk_size):
+                output.write(line)
+        finally:
+            if path:
+                output.close()
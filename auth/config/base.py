@@ -6,6 +6,80 @@ class BaseConfig(object):
     """ Basic config shared in all environments """
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+    SQLALCHEMY_TRACK_MODIFICATIONS = True
 
     SECRET_KEY = os.environ.get('SECRET_KEY')
-    DEBUG = False
\ No newline at end of file
+    DEBUG = False
+
+    # Roles of users are cached by process, set size or ttl (seconds) to 0 to disable
+    PERMISSION_CACHE_SIZE = 10000
+    PERMISSION_CACHE_TTL = 60
+
+    # Keep a bitmask of user roles in session, so permissions are checked without queries
+    PERMISSION_SESSION_MASK = True
+
+    # Changed users and roles are broadcast to all workers: memory, unix or postgres
+    INVALIDATION_TRANSPORT = 'memory'
+    INVALIDATION_CHANNEL = 'flapy_auth_invalidation'
+    INVALIDATION_SOCKET_DIR = '/tmp/flapy_auth_bus'
+
+    # Host wide role masks shared by all workers, e.g. '/dev/shm/flapy_auth_permissions'
+    SHARED_PERMISSIONS_PATH = None
+    SHARED_PERMISSIONS_CAPACITY = 1 << 20
+    SHARED_PERMISSIONS_WORDS = 1
+    # Seconds between attempts of a reader worker to become the writer of table
+    SHARED_PERMISSIONS_ELECTION_INTERVAL = 5
+
+    # Processes used to hash passwords, 0 hashes inline in request thread
+    HASHING_WORKERS = 2
+    HASHING_BULK_WORKERS = 2
+    HASHING_QUEUE_DEPTH = 64
+    HASHING_TIMEOUT = 5
+
+    # Hasher of new passwords: pbkdf2:sha256, pbkdf2:sha512 or scrypt. When target (seconds) is set,
+    # cost is calibrated at startup to take this time in current hardware, by each worker
+    PASSWORD_HASHER = 'pbkdf2:sha256'
+    PASSWORD_HASH_COST = None
+    PASSWORD_HASH_TARGET = None
+    # Hashes are upgraded at login only when their cost is below this fraction of current cost
+    PASSWORD_HASH_UPGRADE_TOLERANCE = 0.8
+
+    # Bloom filter of usernames and emails, rejects unknown logins with a single max(id) query. 0 disables.
+    # Renamed users are only seen through invalidation bus, enable it with unix or postgres transport
+    LOGIN_FILTER_CAPACITY = 0
+    LOGIN_FILTER_ERROR_RATE = 0.001
+
+    # Number of trusted proxies in front of app setting X-Forwarded-For, the address of client is read
+    # from it. 0 keeps the address of connection, which is the address of proxy behind a load balancer
+    PROXY_FIX_X_FOR = 0
+
+    # Login attempts by username and by client address: memory, redis or None to disable.
+    # Rates are attempts refilled by second, bursts are attempts allowed at once. Address burst of None
+    # disables buckets by address, set it only when remote address is the client (see PROXY_FIX_X_FOR)
+    LOGIN_THROTTLE_BACKEND = 'memory'
+    LOGIN_THROTTLE_REDIS_URL = None
+    LOGIN_THROTTLE_SIZE = 100000
+    LOGIN_THROTTLE_USER_RATE = 0.1
+    LOGIN_THROTTLE_USER_BURST = 5
+    LOGIN_THROTTLE_ADDRESS_RATE = 1
+    LOGIN_THROTTLE_ADDRESS_BURST = None
+
+    # Requests in flight by class of endpoint, as (limit, seconds in queue before 503). None disables
+    ADMISSION_LIMITS = {
+        'hash': (8, 1.0),
+        'admin': (16, 2.0),
+        'read': (64, 0.5),
+    }
+
+    # Most users created by a single request of batch creation
+    USER_BATCH_MAX = 1000
+
+    # Rows read by query of NDJSON exports
+    EXPORT_CHUNK_SIZE = 1000
+
+    # Count of rows in listings: exact, cached (until a change of table or ttl) or estimated (planner
+    # statistics of PostgreSQL, exact in other databases)
+    LISTING_COUNT = 'cached'
+    COUNT_CACHE_TTL = 300
+    # Cached counts kept at most, least recently used are evicted first
+    COUNT_CACHE_SIZE = 1000
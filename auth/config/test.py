@@ -6,3 +6,10 @@ from auth.config.base import BaseConfig
 class Config(BaseConfig):
     """ Specific config used in test environment """
     SQLALCHEMY_DATABASE_URI = 'sqlite:///'
+    HASHING_WORKERS = 0
+    HASHING_BULK_WORKERS = 0
+    PASSWORD_HASH_COST = 1000
+    LOGIN_THROTTLE_BACKEND = None
+    ADMISSION_LIMITS = None
+    LISTING_COUNT = 'exact'
+    LOGIN_FILTER_CAPACITY = 100000
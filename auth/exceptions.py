@@ -67,4 +67,16 @@ class RoleNotFound(BaseException):
 
 
 class UserRoleNotFound(BaseException):
-    pass
\ No newline at end of file
+    pass
+
+
+class HashingUnavailable(BaseException):
+    pass
+
+
+class InvalidPatch(BaseException):
+    pass
+
+
+class VersionConflict(BaseException):
+    pass
@@ -0,0 +1,48 @@
+# coding: utf-8
+"""Streaming export of tables as NDJSON, one line by row"""
+import json
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import select
+from auth.models import db
+from auth.serializers import format_datetime
+
+
+def keyset_rows(table, columns, chunk_size=1000):
+    """Yield rows of table in order of id, reading `chunk_size` rows by query after the last id seen.
+
+    Each query is short and uses the primary key index, so nothing is held between chunks and time
+    of a chunk doesn't grow with its position in table, as it would with offset.
+    """
+    columns = list(columns)
+    if table.c.id not in columns:
+        columns.append(table.c.id)
+    last_id = None
+    while True:
+        query = select(columns).order_by(table.c.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][table.c.id]
+
+
+def serialize_row(keys, row):
+    result = OrderedDict()
+    for key, value in zip(keys, row):
+        if isinstance(value, datetime):
+            value = format_datetime(value)
+        result[key] = value
+    return result
+
+
+def export_lines(model, exclude=('password',), chunk_size=1000):
+    """Yield NDJSON lines of all rows of model, without `exclude` columns"""
+    table = model.__table__
+    columns = [column for column in table.c if column.key not in exclude]
+    keys = [column.key for column in columns]
+    for row in keyset_rows(table, columns, chunk_size):
+        yield json.dumps(serialize_row(keys, row)) + '\n'
@@ -26,6 +26,22 @@ def error_handlers(app):
     def conflict(error):
         return make_response(jsonify({'error_code': 'conflict'}), 409)
 
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return make_response(jsonify({'error_code': 'precondition_failed'}), 412)
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = make_response(jsonify({'error_code': 'too_many_requests'}), 429)
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return make_response(jsonify({'error_code': 'service_unavailable'}), 503)
+
     @app.errorhandler(500)
     def server_error(error):
         return make_response(jsonify({'error_code': 'internal_error'}), 500)
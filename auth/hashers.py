@@ -0,0 +1,185 @@
+# coding: utf-8
+"""Registry of password hashers, each one with a single work factor (cost)"""
+import hashlib
+import hmac
+import math
+import time
+from werkzeug.security import check_password_hash, gen_salt
+
+SALT_LENGTH = 16
+
+hashers = {}
+
+
+def register_hasher(cls):
+    """Register a hasher class by its method name"""
+    hashers[cls.method] = cls
+    return cls
+
+
+class Hasher(object):
+    """Base of hashers, encoded hashes have werkzeug format `method:params$salt$hash`"""
+    method = None
+    default_cost = None
+    # Hashes are only upgraded below this fraction of current cost, so workers calibrated to slightly
+    # different costs don't rehash at every login
+    tolerance = 0.8
+
+    def __init__(self, cost=None):
+        self.cost = cost or self.default_cost
+
+    @property
+    def prefix(self):
+        raise NotImplementedError
+
+    def hash(self, password, salt):
+        raise NotImplementedError
+
+    def cost_of(self, prefix):
+        """Return cost from prefix of an encoded hash"""
+        raise NotImplementedError
+
+    def encode(self, password):
+        salt = gen_salt(SALT_LENGTH)
+        return '{}${}${}'.format(self.prefix, salt, self.hash(password, salt))
+
+    def verify(self, encoded, password):
+        prefix, salt, expected = encoded.split('$', 2)
+        hasher = type(self)(self.cost_of(prefix))
+        return hmac.compare_digest(hasher.hash(password, salt), expected)
+
+    def needs_update(self, encoded):
+        """Check if encoded hash was made by another method or with a cost below tolerance of current one"""
+        prefix = encoded.split('$', 1)[0]
+        if method_of(prefix) != self.method:
+            return True
+        try:
+            return self.cost_of(prefix) < self.cost * self.tolerance
+        except (ValueError, IndexError):
+            return True
+
+    def calibrate(self, target):
+        """Return a hasher of this method which takes about `target` seconds to hash"""
+        raise NotImplementedError
+
+
+@register_hasher
+class PBKDF2SHA256Hasher(Hasher):
+    method = 'pbkdf2:sha256'
+    digest = 'sha256'
+    default_cost = 150000
+    step = 10000
+
+    @property
+    def prefix(self):
+        return '{}:{}'.format(self.method, self.cost)
+
+    def hash(self, password, salt):
+        return hashlib.pbkdf2_hmac(self.digest, password.encode('utf-8'), salt.encode('utf-8'), self.cost).hex()
+
+    def cost_of(self, prefix):
+        return int(prefix.split(':')[2])
+
+    def calibrate(self, target):
+        started = time.perf_counter()
+        self.hash('calibration', gen_salt(SALT_LENGTH))
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        cost = int(self.cost * target / elapsed) // self.step * self.step
+        return type(self)(max(cost, self.step))
+
+
+@register_hasher
+class PBKDF2SHA512Hasher(PBKDF2SHA256Hasher):
+    method = 'pbkdf2:sha512'
+    digest = 'sha512'
+    default_cost = 100000
+
+
+@register_hasher
+class ScryptHasher(Hasher):
+    """Scrypt with cost as N, using r=8 and p=1"""
+    method = 'scrypt'
+    default_cost = 2 ** 15
+    block_size = 8
+    parallelism = 1
+
+    @property
+    def prefix(self):
+        return '{}:{}:{}:{}'.format(self.method, self.cost, self.block_size, self.parallelism)
+
+    def hash(self, password, salt):
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'), n=self.cost,
+                              r=self.block_size, p=self.parallelism,
+                              maxmem=256 * self.cost * self.block_size).hex()
+
+    def cost_of(self, prefix):
+        return int(prefix.split(':')[1])
+
+    def verify(self, encoded, password):
+        prefix, salt, expected = encoded.split('$', 2)
+        _, cost, block_size, parallelism = prefix.split(':')
+        hasher = type(self)(int(cost))
+        hasher.block_size = int(block_size)
+        hasher.parallelism = int(parallelism)
+        return hmac.compare_digest(hasher.hash(password, salt), expected)
+
+    def calibrate(self, target):
+        started = time.perf_counter()
+        self.hash('calibration', gen_salt(SALT_LENGTH))
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        # Cost must be a power of 2, time grows linearly with it
+        exponent = int(round(math.log2(self.cost * target / elapsed)))
+        return type(self)(2 ** max(exponent, 10))
+
+
+def method_of(prefix):
+    """Return registered method of hash prefix, e.g. `pbkdf2:sha256` of `pbkdf2:sha256:150000`"""
+    for method in hashers:
+        if prefix == method or prefix.startswith(method + ':'):
+            return method
+
+
+def is_password_hash(encoded):
+    """Check if value is a hash of a registered or werkzeug method, and not a plain text password"""
+    parts = encoded.split('$')
+    if len(parts) != 3 or not parts[1] or not parts[2]:
+        return False
+
+    prefix = parts[0]
+    if method_of(prefix) is not None:
+        return True
+    method = prefix[len('pbkdf2:'):].split(':')[0] if prefix.startswith('pbkdf2:') else prefix
+    return method in hashlib.algorithms_guaranteed
+
+
+def create_hasher(method, cost=None, target=None, tolerance=None):
+    """Create hasher of a registered method, calibrated to take `target` seconds when it's set"""
+    try:
+        hasher = hashers[method](cost)
+    except KeyError:
+        raise ValueError('Unknown password hasher {!r}'.format(method))
+    if target:
+        hasher = hasher.calibrate(target)
+    if tolerance is not None:
+        hasher.tolerance = tolerance
+    return hasher
+
+
+def generate_password(hasher, password):
+    return hasher.encode(password)
+
+
+def check_password(encoded, password):
+    """Check password against a hash of any registered method, or any werkzeug method"""
+    if not encoded or '$' not in encoded:
+        return False
+
+    method = method_of(encoded.split('$', 1)[0])
+    if method is None:
+        return check_password_hash(encoded, password)
+
+    try:
+        return hashers[method]().verify(encoded, password)
+    except (ValueError, IndexError):
+        # Hashes without cost are left to werkzeug, which knows its defaults
+        return check_password_hash(encoded, password)
@@ -0,0 +1,140 @@
+# coding: utf-8
+"""Password hashing out of request threads, in pools of processes"""
+import logging
+import math
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from auth.exceptions import HashingUnavailable
+from auth.hashers import create_hasher, generate_password, check_password
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(object):
+    """A pool of processes with a limit of pending jobs"""
+
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.slots = threading.BoundedSemaphore(queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Processes are started at first use, so each forked worker has its own pool
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def run(self, timeout, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingUnavailable
+
+        try:
+            future = self.executor.submit(function, *args)
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                future.cancel()
+                raise HashingUnavailable
+        finally:
+            self.slots.release()
+
+    def map(self, timeout, function, *iterables):
+        """Run function over iterables in parallel, the whole batch takes one slot of lane.
+
+        Timeout is by item, batch has as long as the items each process runs one after another.
+        """
+        iterables = [list(iterable) for iterable in iterables]
+        size = min(len(iterable) for iterable in iterables) if iterables else 0
+        chunksize = max(min(64, math.ceil(size / self.workers)), 1)
+        if timeout is not None:
+            timeout *= max(math.ceil(math.ceil(size / chunksize) / self.workers) * chunksize, 1)
+
+        if not self.slots.acquire(blocking=False):
+            raise HashingUnavailable
+
+        try:
+            try:
+                return list(self.executor.map(function, *iterables, timeout=timeout, chunksize=chunksize))
+            except TimeoutError:
+                raise HashingUnavailable
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class HashingService(object):
+    """Generate and check password hashes in separate lanes of processes.
+
+    Interactive lane serves logins and password changes, bulk lane serves user creation by admins,
+    so logins are never queued behind a batch of new users. When a lane has too many pending jobs,
+    or a job takes longer than timeout, `HashingUnavailable` is raised. With no workers hashes are
+    made inline.
+
+    New hashes are made by the configured hasher, calibrated at startup when a target time is set.
+    """
+
+    def __init__(self, app=None):
+        self.lanes = {}
+        self.timeout = None
+        self.hasher = create_hasher('pbkdf2:sha256')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+        self.timeout = app.config.get('HASHING_TIMEOUT')
+        target = app.config.get('PASSWORD_HASH_TARGET')
+        self.hasher = create_hasher(app.config.get('PASSWORD_HASHER', 'pbkdf2:sha256'),
+                                    app.config.get('PASSWORD_HASH_COST'), target,
+                                    app.config.get('PASSWORD_HASH_UPGRADE_TOLERANCE'))
+        if target:
+            logger.info('Password hasher %s calibrated to cost %s, set PASSWORD_HASH_COST to use it in all workers',
+                        self.hasher.method, self.hasher.cost)
+        depth = app.config.get('HASHING_QUEUE_DEPTH', 64)
+        workers = {
+            INTERACTIVE: app.config.get('HASHING_WORKERS', 0),
+            BULK: app.config.get('HASHING_BULK_WORKERS', 0),
+        }
+        self.lanes = dict((name, Lane(count, depth)) for name, count in workers.items() if count)
+
+    def generate(self, password, lane=INTERACTIVE):
+        return self._run(lane, generate_password, self.hasher, password)
+
+    def check(self, pwhash, password, lane=INTERACTIVE):
+        return self._run(lane, check_password, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check if hash was made by another hasher or with a lower cost than current one"""
+        return self.hasher.needs_update(pwhash)
+
+    def generate_many(self, passwords, lane=BULK):
+        """Return hashes of passwords, in the same order"""
+        if lane not in self.lanes:
+            return [generate_password(self.hasher, password) for password in passwords]
+        hashers = [self.hasher] * len(passwords)
+        return self.lanes[lane].map(self.timeout, generate_password, hashers, passwords)
+
+    def _run(self, lane, function, *args):
+        if lane not in self.lanes:
+            return function(*args)
+        return self.lanes[lane].run(self.timeout, function, *args)
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.shutdown()
+        self.lanes = {}
+
+
+hashing_service = HashingService()
@@ -0,0 +1,205 @@
+# coding: utf-8
+"""Streaming import of users and role memberships from CSV or NDJSON files"""
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from sqlalchemy import text
+from auth.bus import invalidation_bus
+from auth.exceptions import HashingUnavailable
+from auth.hashers import generate_password, is_password_hash
+from auth.hashing import hashing_service, BULK
+from auth.models import db, insert_ignore, User, Role, UserRole
+
+USERS = 'users'
+USER_ROLES = 'user_roles'
+
+FIELDS = {
+    USERS: ('username', 'email', 'password'),
+    USER_ROLES: ('username', 'role'),
+}
+
+
+def read_records(stream, file_format):
+    """Yield dicts of a CSV (with header) or NDJSON stream, one line at a time"""
+    if file_format == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+    elif file_format == 'ndjson':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise ValueError('Unknown import format {!r}'.format(file_format))
+
+
+def format_of(path):
+    return 'ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def read_chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Progress(object):
+    """Counters of an import, `rate` is rows read by second"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.imported = 0
+        self.skipped = 0
+
+    @property
+    def rate(self):
+        return self.read / max(time.monotonic() - self.started, 1e-6)
+
+    def __str__(self):
+        return '{} rows read, {} imported, {} skipped, {:.0f} rows/s'.format(self.read, self.imported, self.skipped,
+                                                                          self.rate)
+
+
+class Importer(object):
+    """Load users or memberships in chunks, each chunk in its own transaction.
+
+    Only a chunk of rows is in memory at a time, and the session is expunged after each commit. In
+    PostgreSQL rows are copied to a temporary staging table and moved with a single INSERT ... SELECT,
+    other databases get a multi-row insert. Rows conflicting with existing ones are skipped.
+
+    Passwords of users are expected to be hashes, rows with any other password are skipped, unless
+    `hash_passwords` is set.
+    """
+
+    def __init__(self, kind, chunk_size=5000, hash_passwords=False, report=None):
+        if kind not in FIELDS:
+            raise ValueError('Unknown import kind {!r}'.format(kind))
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.hash_passwords = hash_passwords
+        self.report = report
+        self.progress = None
+
+    def run(self, records):
+        self.progress = Progress()
+        copy = db.session.get_bind().dialect.name == 'postgresql'
+        for chunk in read_chunks(records, self.chunk_size):
+            self.progress.read += len(chunk)
+            rows = self.clean(chunk)
+            self.progress.skipped += len(chunk) - len(rows)
+            if rows:
+                imported, user_ids = self.copy(rows) if copy else self.insert(rows)
+                self.progress.imported += imported
+                db.session.commit()
+                db.session.expunge_all()
+                self.changed(user_ids)
+            if self.report:
+                self.report(self.progress)
+        return self.progress
+
+    def clean(self, chunk):
+        """Keep rows with all fields, and valid username, email and password hash of users"""
+        fields = FIELDS[self.kind]
+        rows = [dict((field, (record.get(field) or '').strip()) for field in fields) for record in chunk]
+        rows = [row for row in rows if all(row.values())]
+        if self.kind == USERS:
+            rows = [row for row in rows if User.verify_username(row['username']) and User.verify_email(row['email'])]
+            if not self.hash_passwords:
+                # A plain text password would be stored as it is
+                rows = [row for row in rows if is_password_hash(row['password'])]
+            rows = list(dict((row['username'], row) for row in reversed(rows)).values())
+            if self.hash_passwords and rows:
+                passwords = self.hash([row['password'] for row in rows])
+                for row, pwhash in zip(rows, passwords):
+                    row['password'] = pwhash
+        return rows
+
+    @staticmethod
+    def hash(passwords):
+        """Hash passwords in bulk lane, or in this process when lane is busy, an import has nobody waiting"""
+        try:
+            return hashing_service.generate_many(passwords, lane=BULK)
+        except HashingUnavailable:
+            return [generate_password(hashing_service.hasher, password) for password in passwords]
+
+    def insert(self, rows):
+        """Multi-row insert of chunk, return count of inserted rows and ids of changed users"""
+        if self.kind == USERS:
+            created_at = datetime.now()
+            values = [dict(row, active=True, created_at=created_at, roles_version=0) for row in rows]
+            db.session.execute(insert_ignore(User.__table__).values(values))
+            users = db.session.query(User.id, User.username, User.email).filter(
+                User.username.in_([row['username'] for row in rows]))
+            emails = dict((row['username'], row['email']) for row in rows)
+            user_ids = [user_id for user_id, username, email in users if emails[username] == email]
+            return len(user_ids), user_ids
+
+        users = dict(db.session.query(User.username, User.id).filter(
+            User.username.in_(set(row['username'] for row in rows))))
+        roles = dict(db.session.query(Role.name, Role.id).filter(Role.name.in_(set(row['role'] for row in rows))))
+        created_at = datetime.now()
+        values = [{'user_id': users[row['username']], 'role_id': roles[row['role']], 'created_at': created_at}
+                  for row in rows if row['username'] in users and row['role'] in roles]
+        if not values:
+            return 0, []
+        result = db.session.execute(insert_ignore(UserRole.__table__).values(values))
+        if not result.rowcount:
+            return 0, []
+        return result.rowcount, sorted(set(value['user_id'] for value in values))
+
+    def copy(self, rows):
+        """COPY chunk to a staging table and move it with a single statement, same result of `insert`"""
+        fields = FIELDS[self.kind]
+        staging = 'import_{}'.format(self.kind)
+        db.session.execute(text('CREATE TEMPORARY TABLE IF NOT EXISTS {} ({}) ON COMMIT DELETE ROWS'.format(
+            staging, ', '.join('{} text'.format(field) for field in fields))))
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[field] for field in fields])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(staging, ', '.join(fields)), buffer)
+        finally:
+            cursor.close()
+
+        if self.kind == USERS:
+            statement = '''
+                INSERT INTO "user" (username, email, password, active, created_at, roles_version)
+                SELECT DISTINCT ON (username) username, email, password, true, now(), 0 FROM {}
+                ON CONFLICT DO NOTHING RETURNING id'''
+        else:
+            statement = '''
+                INSERT INTO user_role (user_id, role_id, created_at)
+                SELECT DISTINCT u.id, r.id, now() FROM {} s
+                JOIN "user" u ON u.username = s.username JOIN role r ON r.name = s.role
+                ON CONFLICT DO NOTHING RETURNING user_id'''
+        user_ids = [row[0] for row in db.session.execute(text(statement.format(staging)))]
+        return len(user_ids), sorted(set(user_ids))
+
+    def changed(self, user_ids):
+        """Let login filter and permission caches of all workers know of new users and memberships"""
+        if not user_ids:
+            return
+        if self.kind == USER_ROLES:
+            User.bump_roles_version(user_ids)
+            db.session.commit()
+            db.session.expunge_all()
+        invalidation_bus.publish(users=user_ids)
+
+
+def import_file(path, kind, chunk_size=5000, hash_passwords=False, file_format=None, report=None):
+    """Import a CSV or NDJSON file, format is guessed by extension when it's not given"""
+    importer = Importer(kind, chunk_size=chunk_size, hash_passwords=hash_passwords, report=report)
+    with open(path, newline='', encoding='utf-8') as stream:
+        return importer.run(read_records(stream, file_format or format_of(path)))
@@ -3,8 +3,16 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+from auth.admission import admission
 from auth.blueprints import register_blueprints
+from auth.bloom import login_filter
+from auth.bus import invalidation_bus
+from auth.cache import permission_cache, role_bits, count_cache, evict, evict_all
 from auth.handler import error_handlers
+from auth.hashing import hashing_service
+from auth.shared import shared_permissions
+from auth.throttle import login_throttle
 
 
 db = SQLAlchemy()
@@ -18,6 +26,18 @@ def create_app():
     app.debug = app.config['DEBUG']
 
     db.init_app(app)
+    permission_cache.init_app(app)
+    role_bits.init_app(app)
+    count_cache.init_app(app)
+    invalidation_bus.init_app(app)
+    invalidation_bus.subscribe(evict)
+    invalidation_bus.subscribe_reset(evict_all)
+    shared_permissions.init_app(app)
+    hashing_service.init_app(app)
+    login_filter.init_app(app)
+    invalidation_bus.subscribe(login_filter.on_change)
+    invalidation_bus.subscribe_reset(login_filter.reset)
+    login_throttle.init_app(app)
 
     lm = LoginManager()
     lm.init_app(app)
@@ -32,4 +52,7 @@ def create_app():
     lm.user_loader(load_user)
     error_handlers(app)
     register_blueprints(app)
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    admission.init_app(app)
     return app
@@ -1,9 +1,13 @@
 # coding: utf-8
 from flask_sqlalchemy import models_committed, BaseQuery
-from sqlalchemy import func
+from sqlalchemy import and_, event, exists, func, inspect, select, text, Boolean, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.sql.util import find_tables
 
-from auth.exceptions import SessionNotFound
+from auth.exceptions import SessionNotFound, InvalidPatch, VersionConflict
 from auth.main import db
+from auth.serializers import register_serializer
 
 
 class ModelMixin(object):
@@ -12,6 +16,10 @@ class ModelMixin(object):
     patchable = ()
     unpatchable = ()
 
+    # Raised by `patch` for a missing row and for a value taken by another row
+    not_found = None
+    already_exist = None
+
     def save(self, commit=True):
         db.session.add(self)
         if commit:
@@ -36,6 +44,66 @@ class ModelMixin(object):
         self.save()
         db.session.commit()
 
+    @classmethod
+    def validate_patch(cls, values):
+        """Check fields and types of values of a patch"""
+        allowed = set(cls.patchable) - set(cls.unpatchable)
+        if not values or any(key not in allowed for key in values):
+            raise InvalidPatch
+
+        columns = cls.__table__.c
+        for key, value in values.items():
+            if value is None:
+                if not columns[key].nullable:
+                    raise InvalidPatch
+            elif isinstance(columns[key].type, Boolean) and not isinstance(value, bool):
+                raise InvalidPatch
+            elif isinstance(columns[key].type, String) and not isinstance(value, str):
+                raise InvalidPatch
+
+    @classmethod
+    def patch(cls, object_id, values, version=None, commit=True):
+        """Update `values` of a row with a single statement, without loading it, return the updated row.
+
+        Values are checked against `patchable`. When `version` is given, row is only updated if it's still
+        in that version, else `VersionConflict` is raised. Values of unique columns taken by other rows are
+        not written and raise `already_exist`.
+        """
+        cls.validate_patch(values)
+        table = cls.__table__
+        statement = table.update().where(table.c.id == object_id).values(**values)
+        if 'version' in table.c:
+            statement = statement.values(version=table.c.version + 1)
+            if version is not None:
+                statement = statement.where(table.c.version == version)
+        for key, value in values.items():
+            if table.c[key].unique and value is not None:
+                taken = select([table.c.id]).where(and_(table.c[key] == value, table.c.id != object_id))
+                statement = statement.where(~exists(taken))
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            row = execute_unique(statement.returning(*table.c), cls.already_exist).first()
+        elif execute_unique(statement, cls.already_exist).rowcount:
+            row = db.session.execute(table.select().where(table.c.id == object_id)).first()
+        else:
+            row = None
+
+        if row is None:
+            # Only a failed patch pays a query to find why
+            current = db.session.execute(select([table]).where(table.c.id == object_id)).first()
+            if current is None:
+                raise cls.not_found
+            if version is not None and 'version' in table.c and current['version'] != version:
+                raise VersionConflict
+            raise cls.already_exist
+
+        obj = db.session.identity_map.get(identity_key(cls, object_id))
+        if obj is not None:
+            db.session.expire(obj)
+        if commit:
+            db.session.commit()
+        return row
+
     def __repr__(self):
         field = value = None
         for f in ('name', 'username', 'created', 'uuid'):
@@ -68,12 +136,116 @@ class Query(BaseQuery):
 
         return counter.scalar()
 
+    def estimated_count(self):
+        """Row estimate of planner statistics for a query of a whole table in PostgreSQL, which can be some
+        percent off after many changes, until next analyze. Other databases and filtered queries get exact count.
+        """
+        if self.whereclause is None and db.session.get_bind().dialect.name == 'postgresql':
+            table = self._entities[0].type.__table__
+            estimate = db.session.execute(text('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)'),
+                                          {'name': '"{}"'.format(table.name)}).scalar()
+            # Tables never analyzed have no estimate
+            if estimate is not None and estimate >= 0:
+                return estimate
+        return self.fast_count()
+
+    def cached_count(self):
+        """Exact count kept in count cache, until a change in any table of query"""
+        from auth.cache import count_cache
+        statement = self.statement
+        compiled = statement.compile()
+        key = (str(compiled), tuple(sorted(compiled.params.items())))
+        tables = set(table.name for table in find_tables(statement))
+        return count_cache.get(key, tables, self.fast_count)
+
+    def count_by(self, strategy):
+        """Count rows with strategy `exact`, `cached` or `estimated`"""
+        if strategy == 'exact':
+            return self.fast_count()
+        if strategy == 'cached':
+            return self.cached_count()
+        if strategy == 'estimated':
+            return self.estimated_count()
+        raise ValueError('Unknown count strategy {!r}'.format(strategy))
+
+
+def insert_ignore(table, index_elements=None):
+    """Insert statement that skips rows conflicting with a unique constraint, without errors.
+
+    In PostgreSQL conflicts are only checked in `index_elements` when they're given, any unique
+    constraint otherwise.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert()
+
+
+def execute_unique(statement, conflict):
+    """Execute a statement guarded with NOT EXISTS against taken unique values, in a savepoint.
+
+    A row written meanwhile by a concurrent transaction passes the guard and fails in unique constraint,
+    then `conflict` is raised and session is still usable.
+    """
+    savepoint = db.session.begin_nested()
+    try:
+        result = db.session.execute(statement)
+    except IntegrityError:
+        savepoint.rollback()
+        raise conflict
+    savepoint.commit()
+    return result
+
+
+def insert_or_nothing(model, values, index_elements=None):
+    """Insert a row of model, return its id or None when it conflicts with an existing row.
+
+    Conflicts don't raise IntegrityError, so session is never rolled back. Rows are inserted by
+    core, ORM events of model are not fired.
+    """
+    table = model.__table__
+    statement = insert_ignore(table, index_elements).values(**values)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return db.session.execute(statement.returning(table.c.id)).scalar()
+
+    result = db.session.execute(statement)
+    if not result.rowcount:
+        return None
+    return result.inserted_primary_key[0]
+
+
+def chunks(values, size):
+    """Split a list in lists of `size` values"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
 
 class Model(db.Model, ModelMixin):
     __abstract__ = True
     query_class = Query
 
 
+@event.listens_for(Model, 'before_update', propagate=True)
+def increment_version(mapper, connection, obj):
+    """A change of patchable fields written by ORM makes a new version of row, so patches of older versions fail"""
+    if 'version' not in mapper.columns:
+        return
+    state = inspect(obj)
+    if any(state.attrs[key].history.has_changes() for key in obj.patchable):
+        # Incremented by database, concurrent updates never write the same version
+        obj.version = type(obj).version + 1
+
+
 from auth.models.user import User # noqa
 from auth.models.role import Role # noqa
 from auth.models.user_role import UserRole # noqa
+
+# Serializers are compiled here once, password hashes are never serialized by default
+register_serializer(User)
+register_serializer(Role)
+register_serializer(UserRole)
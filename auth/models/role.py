@@ -1,9 +1,15 @@
 # coding: utf-8
 import re
 from datetime import datetime
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, event, exists, func, distinct, select
+from sqlalchemy.orm import subqueryload
+from auth.bus import invalidation_bus
+from auth.cache import permission_cache, role_bits
 from auth.exceptions import InvalidRoleName, RoleAlreadyExist, RoleNotFound
-from auth.models import Model, db
+from auth.models import Model, db, execute_unique, insert_ignore, insert_or_nothing
+
+# Every bit slot ever given to a role, so slots of deleted roles are not given again
+role_bit_slot = db.Table('role_bit_slot', db.Column('bit', db.Integer, primary_key=True, autoincrement=False))
 
 
 class Role(Model):
@@ -14,6 +20,13 @@ class Role(Model):
     description = db.Column(db.String(255))
     active = db.Column(db.Boolean(), default=True)
     created_at = db.Column(db.DateTime, index=True, default=datetime.now())
+    bit = db.Column(db.Integer, unique=True)
+    version = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+
+    patchable = ('name', 'description', 'active')
+    unpatchable = ('id', 'created_at', 'bit', 'version')
+    not_found = RoleNotFound
+    already_exist = RoleAlreadyExist
 
     @property
     def is_active(self):
@@ -26,31 +39,86 @@ class Role(Model):
         if not cls.verify_role_name(name):
             raise InvalidRoleName
 
-        try:
-            role = Role()
-            role.name = name
-            role.description = description
-            role.save()
-            db.session.commit()
-            return role
-        except IntegrityError:
+        role_id = insert_or_nothing(cls, {'name': name, 'description': description}, index_elements=['name'])
+        if role_id is None:
             raise RoleAlreadyExist
 
+        # Slot is reserved only for a created role, a taken name would keep it out of use forever
+        table = cls.__table__
+        connection = db.session.connection()
+        connection.execute(table.update().where(table.c.id == role_id).values(bit=cls.reserve_bit(connection)))
+
+        db.session.commit()
+        role_bits.clear()
+        invalidation_bus.publish(roles=[role_id])
+        return cls.query.get(role_id)
+
     def edit(self, name=None, description=None):
         """Edit existent role"""
-        try:
-            if name:
-                if not self.verify_role_name(name):
-                    raise InvalidRoleName
-                self.name = name
-            if description:
-                self.description = description
-            self.save()
-            db.session.commit()
-        except IntegrityError:
+        values = {}
+        if name:
+            if not self.verify_role_name(name):
+                raise InvalidRoleName
+            if name != self.name:
+                values['name'] = name
+        if description:
+            values['description'] = description
+        if not values:
+            return self
+
+        table = Role.__table__
+        statement = table.update().where(table.c.id == self.id).values(version=table.c.version + 1, **values)
+        if 'name' in values:
+            # A taken name updates no row instead of failing in unique constraint
+            taken = select([table.c.id]).where(and_(table.c.name == name, table.c.id != self.id))
+            statement = statement.where(~exists(taken))
+        if not execute_unique(statement, RoleAlreadyExist).rowcount:
             raise RoleAlreadyExist
+
+        if 'name' in values:
+            self.bump_users_version()
+        db.session.expire(self, list(values) + ['version'])
+        db.session.commit()
+        permission_cache.invalidate_role(self.id)
+        role_bits.clear()
+        invalidation_bus.publish(roles=[self.id])
         return self
 
+    @classmethod
+    def validate_patch(cls, values):
+        super().validate_patch(values)
+        if 'name' in values and not (values['name'] and cls.verify_role_name(values['name'])):
+            raise InvalidRoleName
+
+    @classmethod
+    def patch(cls, object_id, values, version=None, commit=True):
+        """Patch role with a single statement, see `Model.patch`. A new name or status changes permissions of
+        its users
+        """
+        row = super().patch(object_id, values, version=version, commit=False)
+        if 'name' in values or 'active' in values:
+            from auth.models import User, UserRole
+            User.bump_roles_version(db.session.query(UserRole.user_id).filter(UserRole.role_id == object_id))
+        if commit:
+            db.session.commit()
+            permission_cache.invalidate_role(object_id)
+            role_bits.clear()
+            invalidation_bus.publish(roles=[object_id])
+        return row
+
+    def toggle_status(self):
+        """Activate or deactivate this role, inactive roles do not grant permissions"""
+        self.bump_users_version()
+        super().toggle_status()
+        permission_cache.invalidate_role(self.id)
+
+    def delete(self, commit=True):
+        """Delete this role and forget cached permissions of its users"""
+        role_id = self.id
+        self.bump_users_version()
+        super().delete(commit=commit)
+        permission_cache.invalidate_role(role_id)
+
     @classmethod
     def search_role(cls, name, exactly=False):
         """Search role by name, exactly or not"""
@@ -62,12 +130,81 @@ class Role(Model):
             raise RoleNotFound
         return role
 
+    @classmethod
+    def by_user(cls, user_id):
+        """Return (id, name) of all active roles of a user in a single query"""
+        from auth.models import UserRole
+        return db.session.query(cls.id, cls.name).join(UserRole, UserRole.role_id == cls.id).filter(
+            UserRole.user_id == user_id, cls.active.is_(True)).all()
+
+    @classmethod
+    def held_by(cls, user_id, name):
+        """Check with a single EXISTS query if user holds the active role with this name"""
+        from auth.models import UserRole
+        query = exists().where(UserRole.role_id == cls.id).where(UserRole.user_id == user_id).where(
+            cls.name == name).where(cls.active.is_(True))
+        return db.session.query(query).scalar()
+
+    @classmethod
+    def count_held_by(cls, user_id, names):
+        """Count in a single query how many active roles with these names the user holds"""
+        from auth.models import UserRole
+        return db.session.query(func.count(distinct(cls.name))).join(UserRole, UserRole.role_id == cls.id).filter(
+            UserRole.user_id == user_id, cls.name.in_(names), cls.active.is_(True)).scalar()
+
+    @classmethod
+    def mask_for(cls, user_id):
+        """Return a bitmask with the bit slots of all active roles of a user"""
+        from auth.models import UserRole
+        bits = db.session.query(cls.bit).join(UserRole, UserRole.role_id == cls.id).filter(
+            UserRole.user_id == user_id, cls.active.is_(True))
+        return sum(1 << bit for bit, in bits)
+
+    @classmethod
+    def bit_slots(cls):
+        """Return (name, bit) of all roles"""
+        return db.session.query(cls.name, cls.bit).all()
+
+    @classmethod
+    def reserve_bit(cls, connection):
+        """Reserve and return a bit slot never used by any role.
+
+        Workers keep their map of role name to bit for a while, a slot of a deleted role given to a new
+        role would grant the new role to anyone checked against the old name.
+        """
+        bit = cls.last_bit(connection) + 1
+        while not connection.execute(insert_ignore(role_bit_slot, ['bit']).values(bit=bit)).rowcount:
+            # Slot taken by a concurrent create since it was read
+            bit += 1
+        return bit
+
+    @staticmethod
+    def last_bit(connection):
+        return connection.execute(select([func.coalesce(func.max(role_bit_slot.c.bit), -1)])).scalar()
+
+    def bump_users_version(self):
+        """Expire role masks kept in sessions of all users in this role"""
+        from auth.models import User, UserRole
+        User.bump_roles_version(db.session.query(UserRole.user_id).filter(UserRole.role_id == self.id))
+
     @staticmethod
     def verify_role_name(role_name):
         """Check length and if the username does not contains invalid chars"""
         if len(role_name) >= 3 and re.search(r'^[a-zA-Z0-9_.-]+$', role_name):
             return True
 
+    @classmethod
+    def with_users(cls, query=None):
+        """Query (all roles by default) loading users of roles with 1 more query, for any number of roles"""
+        from auth.models import UserRole
+        query = cls.query if query is None else query
+        return query.options(subqueryload(cls.role_users).joinedload(UserRole.user))
+
+    def users_query(self):
+        """Query of users in this role, to be paginated instead of loading all users"""
+        from auth.models import User, UserRole
+        return User.query.join(UserRole, UserRole.user_id == User.id).filter(UserRole.role_id == self.id)
+
     @property
     def users(self):
         """Return all users in this role"""
@@ -76,8 +213,30 @@ class Role(Model):
             users.append(role_user.user)
         return users
 
-    def remove_all_users(self):
-        """Remove all users in this role"""
-        for role_user in self.role_users:
-            role_user.delete(commit=True)
-        db.session.commit()
+    def remove_all_users(self, commit=True):
+        """Remove all users in this role with a single statement, return number of removed users.
+
+        Without commit, caller must commit and publish change of role.
+        """
+        from auth.models import UserRole
+        removed = UserRole.remove(role_id=self.id)
+        if commit:
+            db.session.commit()
+            permission_cache.invalidate_role(self.id)
+            # Bulk deletes are not seen by models_committed
+            invalidation_bus.publish(roles=[self.id])
+        return removed
+
+
+@event.listens_for(Role, 'before_insert')
+def allocate_bit(mapper, connection, role):
+    """Give a stable bit slot to each new role"""
+    if role.bit is None:
+        role.bit = Role.reserve_bit(connection)
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def clear_role_bits(mapper, connection, role):
+    role_bits.clear()
@@ -5,12 +5,24 @@ import string
 from datetime import datetime
 
 from flask_login import UserMixin
-from sqlalchemy.exc import IntegrityError
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import subqueryload
 
+from auth.bloom import login_filter
+from auth.cache import permission_cache
+from auth.bus import invalidation_bus
+from auth.hashing import hashing_service, INTERACTIVE, BULK
 from auth.exceptions import (InvalidPassword, InvalidUsername, InvalidEmail, PasswordMismatch, UserAlreadyExist,
                              UserNotFound, UserNotHasRole, InvalidCredentials)
-from auth.models import Model, db
+from auth.models import Model, db, insert_ignore, insert_or_nothing, chunks
+
+
+ERROR_CODES = {
+    InvalidUsername: 'invalid_username',
+    InvalidEmail: 'invalid_email',
+    InvalidPassword: 'invalid_password',
+    PasswordMismatch: 'password_mismatch',
+}
 
 
 class User(Model, UserMixin):
@@ -25,10 +37,22 @@ class User(Model, UserMixin):
     last_login_at = db.Column(db.DateTime())
     current_login_at = db.Column(db.DateTime())
     login_count = db.Column(db.Integer())
+    roles_version = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+
+    batch_size = 100
+
+    patchable = ('username', 'email', 'active')
+    unpatchable = ('id', 'password', 'created_at', 'roles_version', 'version')
+    not_found = UserNotFound
+    already_exist = UserAlreadyExist
 
     @classmethod
     def by_login(cls, login):
         """Search user by username or email"""
+        if not login_filter.might_contain(login):
+            raise UserNotFound
+
         if cls.verify_email(login):
             user = cls.query.filter(User.email == login).first()
         else:
@@ -38,8 +62,8 @@ class User(Model, UserMixin):
         return user
 
     @classmethod
-    def create(cls, username, email, password, confirm_password):
-        """ Create a new user """
+    def validate(cls, username, email, password, confirm_password):
+        """Check username, email and password of a new user"""
         if not cls.verify_username(username):
             raise InvalidUsername
 
@@ -52,17 +76,98 @@ class User(Model, UserMixin):
         if password != confirm_password:
             raise PasswordMismatch
 
-        try:
-            user = User()
-            user.username = username
-            user.email = email
-            user.password = cls.generate_password(password)
-            user.save()
-            db.session.commit()
-            return user
-        except IntegrityError:
+    @classmethod
+    def create(cls, username, email, password, confirm_password, lane=INTERACTIVE):
+        """ Create a new user, its password is hashed in `lane` of hashing service """
+        cls.validate(username, email, password, confirm_password)
+
+        if not cls.is_available(username) or not cls.is_available(email):
+            raise UserAlreadyExist
+
+        values = {'username': username, 'email': email, 'password': cls.generate_password(password, lane=lane)}
+        user_id = insert_or_nothing(cls, values)
+        if user_id is None:
             raise UserAlreadyExist
 
+        db.session.commit()
+        login_filter.add(username, email)
+        invalidation_bus.publish(users=[user_id])
+        return cls.query.get(user_id)
+
+    @classmethod
+    def bulk_create(cls, records, lane=BULK):
+        """Create many users in a single transaction.
+
+        Each record is a dict with username, email, password and optionally confirm_password. Returns
+        a result by record, in the same order, with status `created` (and id), `invalid` (and error)
+        or `conflict`, when username or email is taken by a user or by a previous record.
+        """
+        results = [None] * len(records)
+        valid = []
+        for index, record in enumerate(records):
+            username, email = record.get('username') or '', record.get('email') or ''
+            password = record.get('password') or ''
+            try:
+                cls.validate(username, email, password, record.get('confirm_password', password))
+            except (InvalidUsername, InvalidEmail, InvalidPassword, PasswordMismatch) as error:
+                results[index] = {'status': 'invalid', 'error': ERROR_CODES[type(error)]}
+                continue
+            valid.append((index, username, email, password))
+
+        taken = cls.taken_logins([login for _, username, email, _ in valid for login in (username, email)])
+        new = []
+        for index, username, email, password in valid:
+            if username in taken or email in taken:
+                results[index] = {'status': 'conflict'}
+                continue
+            taken.update((username, email))
+            new.append((index, username, email, password))
+
+        passwords = hashing_service.generate_many([password for _, _, _, password in new], lane=lane)
+        created_at = datetime.now()
+        rows = [{'username': username, 'email': email, 'password': pwhash, 'active': True, 'created_at': created_at,
+                 'roles_version': 0} for (_, username, email, _), pwhash in zip(new, passwords)]
+        for chunk in chunks(rows, cls.batch_size):
+            db.session.execute(insert_ignore(cls.__table__).values(chunk))
+
+        # Rows skipped by a concurrent insert of the same username or email are conflicts
+        inserted = {}
+        for chunk in chunks(new, cls.batch_size):
+            users = db.session.query(cls.id, cls.username, cls.email).filter(
+                cls.username.in_([username for _, username, _, _ in chunk]))
+            inserted.update((username, (user_id, email)) for user_id, username, email in users)
+        for index, username, email, _ in new:
+            user_id, inserted_email = inserted.get(username, (None, None))
+            if inserted_email == email:
+                results[index] = {'status': 'created', 'id': user_id}
+                login_filter.add(username, email)
+            else:
+                results[index] = {'status': 'conflict'}
+        db.session.commit()
+
+        invalidation_bus.publish(users=[result['id'] for result in results if result['status'] == 'created'])
+        return results
+
+    @classmethod
+    def taken_logins(cls, logins):
+        """Return the set of logins used as username or email by any user"""
+        logins = [login for login in set(logins) if login_filter.might_contain(login)]
+        taken = set()
+        for chunk in chunks(logins, cls.batch_size):
+            users = db.session.query(cls.username, cls.email).filter(or_(cls.username.in_(chunk),
+                                                                          cls.email.in_(chunk)))
+            for username, email in users:
+                taken.update((username, email))
+        return taken
+
+    @classmethod
+    def is_available(cls, login):
+        """Check if no user has this username or email, without query when login filter knows it"""
+        if not login_filter.might_contain(login):
+            return True
+        query = cls.query.filter(or_(cls.username == login, cls.email == login)).exists()
+        return not db.session.query(query).scalar()
+
     def change_password(self, old_password, password, confirm_password):
         """Change password of user"""
         if not self.validate_password(old_password):
@@ -80,9 +185,19 @@ class User(Model, UserMixin):
 
     def validate_password(self, password):
         """Used for validate hash password"""
-        if check_password_hash(self.password, password):
+        if hashing_service.check(self.password, password):
             return True
 
+    def password_needs_rehash(self):
+        """Check if password hash was made with outdated hasher or cost"""
+        return hashing_service.needs_rehash(self.password)
+
+    def upgrade_password(self, password):
+        """Replace password hash with a new one made by current hasher"""
+        self.password = self.generate_password(password)
+        self.save()
+        db.session.commit()
+
     @staticmethod
     def random_password(size=12):
         """Create a string for password"""
@@ -101,11 +216,23 @@ class User(Model, UserMixin):
             return True
 
     @classmethod
-    def generate_password(cls, password=None):
+    def generate_password(cls, password=None, lane=INTERACTIVE):
         """Create hash when password set or create a random password"""
         if not password:
             password = cls.random_password(12)
-        return generate_password_hash(password)
+        return hashing_service.generate(password, lane=lane)
+
+    @classmethod
+    def with_roles(cls, query=None):
+        """Query (all users by default) loading roles of users with 1 more query, for any number of users"""
+        from auth.models import UserRole
+        query = cls.query if query is None else query
+        return query.options(subqueryload(cls.user_roles).joinedload(UserRole.role))
+
+    def roles_query(self):
+        """Query of roles of this user"""
+        from auth.models import Role, UserRole
+        return Role.query.join(UserRole, UserRole.role_id == Role.id).filter(UserRole.user_id == self.id)
 
     @property
     def roles(self):
@@ -117,14 +244,90 @@ class User(Model, UserMixin):
 
     def has_role(self, role):
         """Verify if this user have role"""
-        if role in self.roles:
+        from auth.models import UserRole
+        query = UserRole.query.filter(UserRole.user_id == self.id, UserRole.role_id == role.id).exists()
+        if db.session.query(query).scalar():
             return True
 
+    def has_role_named(self, name):
+        """Verify if this user have an active role with this name"""
+        from auth.models import Role
+        if Role.held_by(self.id, name):
+            return True
+
+    @classmethod
+    def set_active(cls, active, user_ids=None, email_domain=None):
+        """Activate or deactivate users of ids or of an email domain with a single statement, return number of
+        changed users
+        """
+        query = cls.query.filter(cls.active.isnot(active))
+        if user_ids is not None:
+            query = query.filter(cls.id.in_(set(user_ids)))
+        if email_domain is not None:
+            domain = email_domain.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(cls.email.like('%@' + domain, escape='\\'))
+        updated = query.update({cls.active: active, cls.version: cls.version + 1}, synchronize_session=False)
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, cls):
+                db.session.expire(obj, ['active', 'version'])
+        db.session.commit()
+        return updated
+
+    @classmethod
+    def bulk_delete(cls, user_ids):
+        """Delete users and their memberships with a single statement by table, return number of deleted users
+        and memberships
+        """
+        from auth.models import UserRole
+        user_ids = set(user_ids)
+        memberships = UserRole.remove(user_ids=user_ids)
+        deleted = cls.query.filter(cls.id.in_(user_ids)).delete(synchronize_session=False)
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, cls) and inspect(obj).identity[0] in user_ids:
+                db.session.expunge(obj)
+        db.session.commit()
+        # Bulk deletes are not seen by models_committed
+        invalidation_bus.publish(users=user_ids)
+        return deleted, memberships
+
+    @classmethod
+    def validate_patch(cls, values):
+        super().validate_patch(values)
+        if 'username' in values and not (values['username'] and cls.verify_username(values['username'])):
+            raise InvalidUsername
+        if 'email' in values and not (values['email'] and cls.verify_email(values['email'])):
+            raise InvalidEmail
+
+    @classmethod
+    def patch(cls, object_id, values, version=None, commit=True):
+        """Patch user with a single statement, see `Model.patch`"""
+        row = super().patch(object_id, values, version=version, commit=commit)
+        if 'username' in values or 'email' in values:
+            login_filter.add(row['username'], row['email'])
+        if commit:
+            invalidation_bus.publish(users=[object_id])
+        return row
+
+    @classmethod
+    def bump_roles_version(cls, user_ids):
+        """Expire role masks kept in sessions of these users, `user_ids` can be a list or a query"""
+        cls.query.filter(cls.id.in_(user_ids)).update({cls.roles_version: cls.roles_version + 1},
+                                                       synchronize_session='fetch')
+
     def delete_all_roles(self):
-        """Remove all roles of this user"""
-        if not self.user_roles:
+        """Remove all roles of this user with a single statement, return number of removed roles"""
+        from auth.models import UserRole
+        removed = UserRole.remove(user_ids=[self.id])
+        if not removed:
             raise UserNotHasRole
 
-        for user_role in self.user_roles:
-            user_role.delete(commit=True)
         db.session.commit()
+        permission_cache.invalidate_user(self.id)
+        # Bulk deletes are not seen by models_committed
+        invalidation_bus.publish(users=[self.id])
+        return removed
+
+
+@event.listens_for(User, 'after_insert')
+def add_to_login_filter(mapper, connection, user):
+    login_filter.add(user.username, user.email)
@@ -1,7 +1,11 @@
 # coding: utf-8
 from datetime import datetime
-from sqlalchemy.exc import IntegrityError
-from auth.models import Model, db, User, Role
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.util import identity_key
+from auth.cache import permission_cache
+from auth.bus import invalidation_bus
+from auth.models import Model, db, User, Role, insert_ignore, insert_or_nothing, chunks
 from auth.exceptions import UserAlreadyInRole, UserRoleNotFound
 
 
@@ -12,23 +16,28 @@ class UserRole(Model):
     created_at = db.Column(db.DateTime, index=True, default=datetime.now())
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
     user = db.relationship("User", backref="user_roles")
-    role_id = db.Column(db.Integer, db.ForeignKey(Role.id))
+    role_id = db.Column(db.Integer, db.ForeignKey(Role.id), index=True)
     role = db.relationship("Role", backref="role_users")
 
     __table_args__ = (db.UniqueConstraint('user_id', 'role_id', name='un_user_role'),)
 
+    batch_size = 1000
+
     @classmethod
     def set_role(cls, user, role):
         """Create a relationship of role and user"""
-        try:
-            user_role = cls()
-            user_role.user_id = user.id
-            user_role.role_id = role.id
-            user_role.save()
-            db.session.commit()
-        except IntegrityError:
+        values = {'user_id': user.id, 'role_id': role.id, 'created_at': datetime.now()}
+        if insert_or_nothing(cls, values, index_elements=['user_id', 'role_id']) is None:
             raise UserAlreadyInRole
 
+        User.bump_roles_version([user.id])
+        db.session.expire(user, ['user_roles'])
+        db.session.expire(role, ['role_users'])
+        db.session.commit()
+        permission_cache.invalidate_user(user.id)
+        # Rows inserted by core are not seen by models_committed
+        invalidation_bus.publish(users=[user.id])
+
     @classmethod
     def delete_role(cls, user, role):
         user_role = cls.query.filter(cls.user == user, cls.role == role).first()
@@ -37,3 +46,82 @@ class UserRole(Model):
 
         db.session.delete(user_role)
         db.session.commit()
+        permission_cache.invalidate_user(user.id)
+
+    @classmethod
+    def assign(cls, role_id, user_ids):
+        """Add users to role with multi-row inserts skipping current members, return number of inserted rows
+        and ids of users not found. Caller commits and invalidates caches.
+        """
+        user_ids = set(user_ids)
+        found = set()
+        for chunk in chunks(sorted(user_ids), cls.batch_size):
+            found.update(user_id for user_id, in db.session.query(User.id).filter(User.id.in_(chunk)))
+
+        inserted = 0
+        created_at = datetime.now()
+        statement = insert_ignore(cls.__table__, index_elements=['user_id', 'role_id'])
+        for chunk in chunks(sorted(found), cls.batch_size):
+            rows = [{'user_id': user_id, 'role_id': role_id, 'created_at': created_at} for user_id in chunk]
+            inserted += db.session.execute(statement.values(rows)).rowcount
+            db.session.execute(User.__table__.update().where(User.id.in_(chunk)).values(
+                roles_version=User.roles_version + 1))
+
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, User) and inspect(obj).identity[0] in found:
+                db.session.expire(obj, ['user_roles', 'roles_version'])
+            elif isinstance(obj, Role) and inspect(obj).identity[0] == role_id:
+                db.session.expire(obj, ['role_users'])
+        return inserted, sorted(user_ids - found)
+
+    @classmethod
+    def remove(cls, role_id=None, user_ids=None):
+        """Delete memberships of a role and/or of users with a single statement, return number of deleted rows.
+
+        Role masks of affected users are expired in the same transaction. Memberships loaded in session
+        are expunged and loaded collections are expired, caller commits and invalidates caches.
+        """
+        criteria = []
+        if role_id is not None:
+            criteria.append(cls.role_id == role_id)
+        if user_ids is not None:
+            user_ids = set(user_ids)
+            criteria.append(cls.user_id.in_(user_ids))
+
+        members = db.session.query(cls.user_id).filter(*criteria)
+        db.session.execute(User.__table__.update().where(User.id.in_(members.subquery())).values(
+            roles_version=User.roles_version + 1))
+        removed = cls.query.filter(*criteria).delete(synchronize_session=False)
+
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, cls):
+                # Expired memberships could be deleted too, they're expunged as well
+                values = inspect(obj).dict
+                role_matches = role_id is None or 'role_id' not in values or values['role_id'] == role_id
+                user_matches = user_ids is None or 'user_id' not in values or values['user_id'] in user_ids
+                if role_matches and user_matches:
+                    db.session.expunge(obj)
+            elif isinstance(obj, User):
+                db.session.expire(obj, ['user_roles', 'roles_version'])
+            elif isinstance(obj, Role):
+                db.session.expire(obj, ['role_users'])
+        return removed
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def bump_roles_version(session, flush_context):
+    """Any membership written by the session expires the role masks of its users"""
+    user_ids = set(obj.user_id for obj in list(session.new) + list(session.deleted)
+                   if isinstance(obj, UserRole) and obj.user_id is not None)
+    if user_ids:
+        session.execute(User.__table__.update().where(User.id.in_(user_ids)).values(
+            roles_version=User.roles_version + 1))
+        session.info.setdefault('roles_version_bumped', set()).update(user_ids)
+
+
+@event.listens_for(SignallingSession, 'after_flush_postexec')
+def expire_roles_version(session, flush_context):
+    for user_id in session.info.pop('roles_version_bumped', ()):
+        user = session.identity_map.get(identity_key(User, user_id))
+        if user is not None:
+            session.expire(user, ['roles_version'])
@@ -0,0 +1,76 @@
+# coding: utf-8
+"""Serializers of models to dicts, compiled once by model and set of fields"""
+import operator
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import DateTime
+
+DEFAULT_EXCLUDE = ('password',)
+
+serializers = {}
+
+
+def format_datetime(value):
+    """Same as strftime('%d/%m/%Y %H:%M:%S'), without parsing a format by value"""
+    return '%02d/%02d/%04d %02d:%02d:%02d' % (value.day, value.month, value.year, value.hour, value.minute,
+                                              value.second)
+
+
+class Serializer(object):
+    """Extract `fields` of objects of a model to an ordered dict, formatting dates"""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        columns = model.__mapper__.c
+        self.dates = tuple(index for index, field in enumerate(self.fields)
+                           if isinstance(columns[field].type, DateTime))
+        getter = operator.attrgetter(*self.fields)
+        # attrgetter of a single field returns a value, not a tuple
+        self._getter = getter if len(self.fields) > 1 else lambda obj: (getter(obj),)
+
+    def __call__(self, obj):
+        values = self._getter(obj)
+        if self.dates:
+            values = list(values)
+            for index in self.dates:
+                if isinstance(values[index], datetime):
+                    values[index] = format_datetime(values[index])
+        return OrderedDict(zip(self.fields, values))
+
+
+def register_serializer(model, include=None, exclude=DEFAULT_EXCLUDE):
+    """Set default fields of model, all columns in order of table by default, without `exclude`"""
+    keys = model.__mapper__.c.keys()
+    fields = [key for key in keys if (include is None or key in include) and key not in exclude]
+    serializers[model, None] = Serializer(model, fields)
+    return model
+
+
+def serializer_for(model, fields=None):
+    """Return serializer of model with default fields, or only with `fields` (kept in order of table)"""
+    key = (model, frozenset(fields) if fields is not None else None)
+    serializer = serializers.get(key)
+    if serializer is None:
+        if fields is None:
+            register_serializer(model)
+        else:
+            serializers[key] = Serializer(model, [name for name in model.__mapper__.c.keys() if name in fields])
+        serializer = serializers[key]
+    return serializer
+
+
+def serialize(obj, fields=None):
+    return serializer_for(type(obj), fields)(obj)
+
+
+def serialize_list(objects, fields=None):
+    """Serialize objects, compiled serializer is looked up once by class"""
+    result = []
+    model = serializer = None
+    for obj in objects:
+        if type(obj) is not model:
+            model = type(obj)
+            serializer = serializer_for(model, fields)
+        result.append(serializer(obj))
+    return result
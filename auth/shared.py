@@ -0,0 +1,359 @@
+# coding: utf-8
+"""Host wide table of role masks, shared in memory by all workers"""
+import fcntl
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from sqlalchemy import select
+
+from auth.bus import invalidation_bus
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<8sQII')
+MAGIC = b'FLAPYPRM'
+NAME_SIZE = 80
+EMPTY = 0
+
+
+class SharedPermissionTable(object):
+    """Memory mapped table of user id to roles version and role mask, plus role bit slot to role name.
+
+    Users are kept in an open addressing hash table, filled up to `max_load` and with at most
+    `max_probes` slots searched by user. Users that don't fit are not kept, readers use another
+    source. Only one process writes the table, guarded by a lock file, the others only read it.
+    Readers use the sequence in header as a seqlock: it's odd while the writer changes the table,
+    and changes after each write.
+    """
+    max_load = 0.7
+    max_probes = 32
+
+    def __init__(self, path, capacity=1 << 20, words=1):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.overflow = 0
+        self.words = words
+        self.bits = words * 64
+        self.entry = struct.Struct('<qq{}Q'.format(words))
+        self.users_offset = HEADER.size + self.bits * NAME_SIZE
+        self.size = self.users_offset + capacity * self.entry.size
+        self.ready = False
+        self._map = None
+        self._writer_map = None
+        self._lock_file = None
+        self._names = (None, {})
+
+    # Reader
+
+    def lookup(self, user_id, roles_version):
+        """Return (mask, bits) of user when table has its current memberships, otherwise None.
+
+        `bits` is a dict of role name to bit slot.
+        """
+        table = self._open()
+        if table is None:
+            return None
+
+        for _ in range(3):
+            sequence = self._sequence(table)
+            if sequence & 1:
+                continue
+            entry = self._find(table, user_id)
+            bits = self._role_bits(table, sequence)
+            if self._sequence(table) == sequence:
+                break
+        else:
+            return None
+
+        if entry is None or entry[1] != roles_version:
+            return None
+
+        mask = 0
+        for index, word in enumerate(entry[2:]):
+            mask |= word << (64 * index)
+        return mask, bits
+
+    def _open(self):
+        if self._map is None:
+            try:
+                with open(self.path, 'rb') as table_file:
+                    table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+
+            magic, _, capacity, words = HEADER.unpack_from(table, 0)
+            if magic != MAGIC or capacity != self.capacity or words != self.words or len(table) != self.size:
+                table.close()
+                return None
+            self._map = table
+        return self._map
+
+    @staticmethod
+    def _sequence(table):
+        return HEADER.unpack_from(table, 0)[1]
+
+    def _slots(self, user_id):
+        slot = (user_id * 2654435761) % self.capacity
+        for _ in range(min(self.max_probes, self.capacity)):
+            yield slot
+            slot = (slot + 1) % self.capacity
+
+    def _find(self, table, user_id):
+        for slot in self._slots(user_id):
+            entry = self.entry.unpack_from(table, self.users_offset + slot * self.entry.size)
+            if entry[0] == user_id:
+                return entry
+            if entry[0] == EMPTY:
+                return None
+
+    def _role_bits(self, table, sequence):
+        cached_sequence, bits = self._names
+        if cached_sequence == sequence:
+            return bits
+
+        bits = {}
+        for bit in range(self.bits):
+            offset = HEADER.size + bit * NAME_SIZE
+            name = table[offset:offset + NAME_SIZE].rstrip(b'\0')
+            if name:
+                bits[name.decode('utf-8')] = bit
+        self._names = (sequence, bits)
+        return bits
+
+    # Writer
+
+    def acquire(self):
+        """Try to be the single writer of table, return True when this process writes it"""
+        if self._writer_map is not None:
+            return True
+
+        lock_file = open(self.path + '.lock', 'a+b')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self._writer_map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self._lock_file = lock_file
+        return True
+
+    def rebuild(self, roles, users):
+        """Write the whole table, `roles` are (bit, name) and `users` are (user_id, roles_version, mask)"""
+        table = self._writer_map
+        self.count = self.overflow = 0
+        self._begin(table)
+        try:
+            table[HEADER.size:] = bytes(self.size - HEADER.size)
+            self._write_roles(table, roles)
+            for user in users:
+                self._write_user(table, *user)
+        finally:
+            self._end(table)
+        self.ready = True
+        self._log_overflow()
+
+    def update_roles(self, roles):
+        table = self._writer_map
+        self._begin(table)
+        try:
+            table[HEADER.size:self.users_offset] = bytes(self.users_offset - HEADER.size)
+            self._write_roles(table, roles)
+        finally:
+            self._end(table)
+
+    def update_users(self, users):
+        table = self._writer_map
+        overflow = self.overflow
+        self._begin(table)
+        try:
+            for user in users:
+                self._write_user(table, *user)
+        finally:
+            self._end(table)
+        if not overflow:
+            self._log_overflow()
+
+    def _begin(self, table):
+        magic, sequence, _, _ = HEADER.unpack_from(table, 0)
+        HEADER.pack_into(table, 0, MAGIC, sequence + 1 if sequence % 2 == 0 else sequence + 2,
+                         self.capacity, self.words)
+
+    def _end(self, table):
+        sequence = self._sequence(table)
+        HEADER.pack_into(table, 0, MAGIC, sequence + 1, self.capacity, self.words)
+
+    def _write_roles(self, table, roles):
+        for bit, name in roles:
+            if bit is None or bit >= self.bits:
+                continue
+            offset = HEADER.size + bit * NAME_SIZE
+            table[offset:offset + NAME_SIZE] = name.encode('utf-8')[:NAME_SIZE].ljust(NAME_SIZE, b'\0')
+
+    def _write_user(self, table, user_id, roles_version, mask):
+        if mask >> self.bits:
+            # Some role does not fit in the mask, readers will use another source
+            roles_version = -1
+            mask = 0
+
+        words = [(mask >> (64 * index)) & 0xFFFFFFFFFFFFFFFF for index in range(self.words)]
+        for slot in self._slots(user_id):
+            offset = self.users_offset + slot * self.entry.size
+            current = struct.unpack_from('<q', table, offset)[0]
+            if current == user_id:
+                self.entry.pack_into(table, offset, user_id, roles_version, *words)
+                return
+            if current == EMPTY:
+                if self.count >= self.capacity * self.max_load:
+                    break
+                self.entry.pack_into(table, offset, user_id, roles_version, *words)
+                self.count += 1
+                return
+        self.overflow += 1
+
+    def _log_overflow(self):
+        if self.overflow:
+            logger.warning('Shared permission table is full, %s users are not kept, raise '
+                           'SHARED_PERMISSIONS_CAPACITY', self.overflow)
+
+    def close(self):
+        for table in (self._map, self._writer_map):
+            if table is not None:
+                table.close()
+        self._map = self._writer_map = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class SharedPermissions(object):
+    """Keep a `SharedPermissionTable` of all users in sync with database.
+
+    The worker that holds the lock of table rebuilds it at first request, and then updates it from
+    changes broadcast by the invalidation bus. Other workers only read it, and try again to be the
+    writer every `election_interval` seconds, so a table left by a dead writer is taken over.
+    """
+    batch_size = 10000
+
+    def __init__(self, app=None):
+        self.app = None
+        self.table = None
+        self.election_interval = 5
+        self._changes = queue.Queue()
+        self._thread = None
+        self._next_election = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config.get('SHARED_PERMISSIONS_PATH')
+        if not path:
+            return
+
+        self.app = app
+        self.table = SharedPermissionTable(path, app.config.get('SHARED_PERMISSIONS_CAPACITY', 1 << 20),
+                                           app.config.get('SHARED_PERMISSIONS_WORDS', 1))
+        self.election_interval = app.config.get('SHARED_PERMISSIONS_ELECTION_INTERVAL', self.election_interval)
+        invalidation_bus.subscribe(self.on_change)
+        invalidation_bus.subscribe_reset(self.on_reset)
+        app.before_first_request(self.start)
+
+    def lookup(self, user):
+        """Return (mask, bits) of user or None when table is disabled or does not know its current roles"""
+        if self.table is None:
+            return None
+        return self.table.lookup(user.id, user.roles_version)
+
+    def start(self):
+        """Become the writer when no other process holds the table, the new writer rebuilds it"""
+        with self._lock:
+            self._next_election = time.monotonic() + self.election_interval
+            if self._thread is None and self.table.acquire():
+                self._changes.put(None)
+                self._thread = threading.Thread(target=self._write, name='shared-permissions', daemon=True)
+                self._thread.start()
+
+    def on_change(self, kind, key_id):
+        """Handler of invalidation bus, only the writer keeps changes, since others have nothing to write"""
+        if self.table is None:
+            return
+        if self._thread is None and time.monotonic() >= self._next_election:
+            self.start()
+        if self._thread is not None:
+            self._changes.put((kind, key_id))
+
+    def on_reset(self):
+        """Reset handler of invalidation bus, writer rebuilds the whole table since changes were missed"""
+        if self._thread is not None:
+            self._changes.put(None)
+
+    def _write(self):
+        from auth.main import db
+        engine = db.get_engine(self.app)
+        while True:
+            changes = [self._changes.get()]
+            while not self._changes.empty():
+                changes.append(self._changes.get())
+            try:
+                with engine.connect() as connection:
+                    self._apply(connection, changes)
+            except Exception:
+                logger.exception('Could not update shared permission table')
+
+    def _apply(self, connection, changes):
+        from auth.models import User, UserRole
+        if None in changes or not self.table.ready:
+            self.table.rebuild(self._roles(connection), self._all_users(connection))
+            return
+
+        user_ids = set(key_id for kind, key_id in changes if kind == 'user')
+        role_ids = [key_id for kind, key_id in changes if kind == 'role']
+        if role_ids:
+            self.table.update_roles(self._roles(connection))
+            members = select([UserRole.user_id]).where(UserRole.role_id.in_(role_ids))
+            user_ids.update(user_id for user_id, in connection.execute(members))
+        if user_ids:
+            users = select([User.id, User.roles_version]).where(User.id.in_(sorted(user_ids)))
+            self.table.update_users(self._masks(connection, connection.execute(users).fetchall()))
+
+    @staticmethod
+    def _roles(connection):
+        from auth.models import Role
+        return connection.execute(select([Role.bit, Role.name])).fetchall()
+
+    def _all_users(self, connection):
+        from auth.models import User
+        last_id = 0
+        while True:
+            users = connection.execute(select([User.id, User.roles_version]).where(User.id > last_id).order_by(
+                User.id).limit(self.batch_size)).fetchall()
+            if not users:
+                return
+            for user in self._masks(connection, users):
+                yield user
+            last_id = users[-1][0]
+
+    @staticmethod
+    def _masks(connection, users):
+        """Return (user_id, roles_version, mask) of users, given as (user_id, roles_version)"""
+        from auth.models import Role, UserRole
+        masks = dict((user_id, 0) for user_id, _ in users)
+        bits = select([UserRole.user_id, Role.bit]).select_from(UserRole.__table__.join(Role.__table__)).where(
+            UserRole.user_id.in_(list(masks))).where(Role.active.is_(True)).where(Role.bit.isnot(None))
+        for user_id, bit in connection.execute(bits):
+            masks[user_id] |= 1 << bit
+        return [(user_id, roles_version, masks[user_id]) for user_id, roles_version in users]
+
+
+shared_permissions = SharedPermissions()
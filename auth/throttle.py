@@ -0,0 +1,117 @@
+# coding: utf-8
+"""Token buckets limiting login attempts by username and by client address"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from werkzeug.exceptions import TooManyRequests
+
+
+class LoginThrottled(TooManyRequests):
+    """Raised when there are too many login attempts, `retry_after` is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class MemoryBackend(object):
+    """Token buckets of a single process, kept in a LRU of fixed size"""
+
+    def __init__(self, size=100000):
+        self.size = size
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst, now):
+        """Take a token of bucket, return 0 when allowed or seconds to wait for next token"""
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBackend(object):
+    """Token buckets kept in Redis, shared by all workers"""
+    script = """
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + (now - updated_at) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self._consume = self.client.register_script(self.script)
+
+    def consume(self, key, rate, burst, now):
+        return float(self._consume(keys=['flapy_auth:throttle:' + key], args=[rate, burst, now]))
+
+
+class LoginThrottle(object):
+    """Limit login attempts of each username and of each client address.
+
+    Each key has a bucket of `burst` attempts refilled with `rate` attempts per second. Buckets by
+    address are only used when configured, behind a proxy all clients share its address.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('LOGIN_THROTTLE_BACKEND')
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config.get('LOGIN_THROTTLE_SIZE', 100000))
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['LOGIN_THROTTLE_REDIS_URL'])
+        elif backend:
+            raise ValueError('Unknown login throttle backend {!r}'.format(backend))
+        else:
+            self.backend = None
+
+        self.limits = {
+            'user': (app.config.get('LOGIN_THROTTLE_USER_RATE', 0.1), app.config.get('LOGIN_THROTTLE_USER_BURST', 5)),
+        }
+        if app.config.get('LOGIN_THROTTLE_ADDRESS_BURST'):
+            self.limits['address'] = (app.config.get('LOGIN_THROTTLE_ADDRESS_RATE', 1),
+                                      app.config['LOGIN_THROTTLE_ADDRESS_BURST'])
+
+    def hit(self, username, address):
+        """Count a login attempt, raise `LoginThrottled` when username or address has no attempts left"""
+        if self.backend is None:
+            return
+
+        now = time.time()
+        wait = 0
+        for kind, value in (('user', username.lower()), ('address', address or 'unknown')):
+            if kind not in self.limits:
+                continue
+            rate, burst = self.limits[kind]
+            wait = max(wait, self.backend.consume('{}:{}'.format(kind, value), rate, burst, now))
+        if wait:
+            raise LoginThrottled(int(math.ceil(wait)))
+
+
+login_throttle = LoginThrottle()
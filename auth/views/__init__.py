@@ -1,57 +1,199 @@
 # coding: utf-8
-from collections import OrderedDict
+import base64
+import binascii
 from functools import wraps
-from flask import request, abort
+from flask import request, abort, current_app, session
 from flask_login import current_user
-from datetime import datetime
-from auth.models import User, Role
-from auth.exceptions import RoleNotFound
+from sqlalchemy.orm import load_only
+from auth.cache import permission_cache, role_bits
+from auth.models import Role
+from auth.serializers import serialize, serialize_list, serializer_for
+from auth.shared import shared_permissions
 
 
-def login_permission(permission):
-    """Check if current_user has a permission to see"""
+def login_permission(*permissions, mode='any'):
+    """Check if current_user has permissions to see.
+
+    With mode `any` one of the permissions is enough, with mode `all` user must have every permission.
+    """
+    if mode not in ('any', 'all'):
+        raise ValueError('Permission mode must be "any" or "all"')
+    permissions = frozenset(permissions)
+
     def decorator(function):
         @wraps(function)
         def wrapper(*args, **kwargs):
-            user = User.query.get(current_user.get_id())
-            try:
-                role = Role.search_role(permission, True)
-                if user.has_role(role):
-                    return function(*args, **kwargs)
-            except RoleNotFound:
-                return abort(403)
+            if has_permission(current_user, permissions, mode):
+                return function(*args, **kwargs)
             return abort(403)
         return wrapper
     return decorator
 
 
-def dict_object(query_object):
-    result = OrderedDict()
-    for key in query_object.__mapper__.c.keys():
-        result[key] = getattr(query_object, key)
+def has_permission(user, permissions, mode='any'):
+    """Resolve a set of permissions with the shared permission table, the role mask in session,
+    a single cache lookup or a single query"""
+    shared = shared_permissions.lookup(user)
+    if shared is not None:
+        mask, bits = shared
+        return mask_has_permission(mask, permissions, mode, bits)
+
+    if current_app.config.get('PERMISSION_SESSION_MASK'):
+        return mask_has_permission(session_role_mask(user), permissions, mode)
+
+    user_id = user.id
+    if permission_cache.enabled:
+        names = role_names(user_id)
+        if mode == 'all':
+            return permissions <= names
+        return not permissions.isdisjoint(names)
+
+    if len(permissions) == 1:
+        return bool(Role.held_by(user_id, next(iter(permissions))))
+
+    held = Role.count_held_by(user_id, permissions)
+    if mode == 'all':
+        return held == len(permissions)
+    return held > 0
+
+
+def mask_has_permission(mask, permissions, mode='any', bits=None):
+    """Check permissions against a bitmask of role slots, `bits` maps role name to slot"""
+    if bits is None:
+        bits = role_bits.get(Role.bit_slots)
+    granted = [bits.get(name) is not None and bool(mask >> bits[name] & 1) for name in permissions]
+    if mode == 'all':
+        return all(granted)
+    return any(granted)
+
+
+def session_role_mask(user):
+    """Return the role mask kept in session, refreshing it when memberships of user changed"""
+    roles = session.get('roles')
+    if not roles or roles.get('user') != user.id or roles.get('version') != user.roles_version:
+        roles = store_role_mask(user)
+    return roles['mask']
+
+
+def store_role_mask(user):
+    """Keep in session the bitmask of active roles of user and the version of its memberships"""
+    roles = {'user': user.id, 'version': user.roles_version, 'mask': Role.mask_for(user.id)}
+    session['roles'] = roles
+    return roles
+
+
+def role_names(user_id):
+    """Return names of all active roles of user, using permission cache when it's warm"""
+    names = permission_cache.get(user_id)
+    if names is None:
+        names = permission_cache.set(user_id, Role.by_user(user_id))
+    return names
+
+
+def dict_object(query_object, fields=None):
+    return serialize(query_object, fields)
+
 
-        if isinstance(result[key], datetime):
-            result[key] = getattr(query_object, key).strftime('%d/%m/%Y %H:%M:%S')
-    return result
+def dict_list(query, fields=None):
+    return serialize_list(query, fields)
 
 
-def dict_list(query):
-    list = []
-    for query_object in query:
-        list.append(dict_object(query_object))
-    return list
+def requested_fields(model):
+    """Return fields of `?fields=id,username`, or None when all fields are requested.
 
+    Fields must be serialized by default for model, any other field is a bad request.
+    """
+    value = request.args.get('fields')
+    if not value:
+        return None
 
-def query_object_list(model, paginable=True):
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    allowed = serializer_for(model).fields
+    if not fields or any(field not in allowed for field in fields):
+        abort(400)
+    return fields
+
+
+def requested_includes(*allowed):
+    """Return set of relations of `?include=roles`, relations not `allowed` are a bad request"""
+    value = request.args.get('include')
+    if not value:
+        return set()
+
+    includes = set(name.strip() for name in value.split(',') if name.strip())
+    if not includes <= set(allowed):
+        abort(400)
+    return includes
+
+
+def load_fields(query, fields):
+    """Load only columns of fields (and primary key) in query"""
+    if fields is None:
+        return query
+    return query.options(load_only(*set(fields) | {'id'}))
+
+
+def encode_cursor(last_id):
+    """Opaque cursor of the page after the row with `last_id`"""
+    return base64.urlsafe_b64encode('id:{}'.format(last_id).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return last id of cursor, invalid cursors are a bad request"""
+    try:
+        value = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii')).decode('ascii')
+        kind, _, last_id = value.partition(':')
+        if kind == 'id':
+            return int(last_id)
+    except (ValueError, binascii.Error):
+        pass
+    abort(400)
+
+
+def query_object_list(model, paginable=True, query=None, descending=True, count=None, related=(), sparse=True):
+    """Return a page of rows of query (all rows of model by default), total of rows and cursor of next page.
+
+    Rows are ordered by id, newest first unless `descending` is False. Pages are selected by
+    `?after=<cursor>&limit=`, which seeks in primary key index, or by `?offset=` kept for old clients,
+    which reads and discards previous rows. Cursor of next page is None on last page.
+
+    Total is counted with `count` strategy, `LISTING_COUNT` of config by default, and it's None when
+    request has `?count=false`. Only `?fields=` are loaded and serialized when it's given, unless `sparse`
+    is False because fields are of another model.
+
+    Each row gets its `related` objects serialized, which query should load eagerly.
+    """
+    after = None
+    offset = 0
+    limit = 10
+    fields = None
     if paginable:
-        # Get Request Args from get /?limit=10&offset=0
+        # Get Request Args from get /?limit=10&after=<cursor> or /?limit=10&offset=0
         limit = request.args.get('limit', 10, type=int)
-        offset = request.args.get('offset', 0,  type=int)
+        after = request.args.get('after')
+        offset = request.args.get('offset', 0, type=int)
+        fields = requested_fields(model) if sparse else None
+
+    query = model.query if query is None else query
+    if request.args.get('count', '').lower() in ('false', '0'):
+        total = None
+    else:
+        total = query.count_by(count or current_app.config.get('LISTING_COUNT', 'exact'))
+    if descending:
+        query = query.order_by(model.id.desc())
     else:
-        limit = 10
-        offset = 0
+        query = query.order_by(model.id)
+    if after is not None:
+        last_id = decode_cursor(after)
+        query = query.filter(model.id < last_id if descending else model.id > last_id)
+    elif offset:
+        query = query.offset(offset)
 
-    query = model.query
-    count = query.fast_count()
-    data = dict_list(query.order_by(model.id.desc()).limit(limit).offset(offset).all())
-    return data, count
+    rows = load_fields(query, fields).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit > 0 else None
+    rows = rows[:limit]
+    data = dict_list(rows, fields)
+    for name in related:
+        for row, values in zip(rows, data):
+            values[name] = dict_list(getattr(row, name))
+    return data, total, next_cursor
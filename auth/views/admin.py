@@ -1,11 +1,17 @@
 # coding: utf-8
 """The views of user administration are here"""
-from flask import Blueprint, abort, jsonify, request, redirect
+from flask import Blueprint, Response, abort, jsonify, request, redirect, current_app, stream_with_context
 from flask_login import login_required
-from auth.models import User, Role, UserRole
-from auth.views import login_permission, query_object_list, dict_object, dict_list
+from auth.bus import invalidation_bus
+from auth.models import db, User, Role, UserRole
+from auth.exporter import export_lines
+from auth.views import (login_permission, query_object_list, dict_object, dict_list, requested_fields,
+                         requested_includes, load_fields)
 from auth.exceptions import (InvalidUsername, InvalidEmail, InvalidPassword, PasswordMismatch, UserAlreadyExist,
-                             InvalidRoleName, RoleAlreadyExist, UserAlreadyInRole, UserRoleNotFound, UserNotHasRole)
+                             InvalidRoleName, RoleAlreadyExist, UserAlreadyInRole, UserRoleNotFound, UserNotHasRole,
+                             HashingUnavailable, InvalidPatch, VersionConflict, UserNotFound, RoleNotFound)
+from auth.hashing import BULK
+from auth.serializers import serializer_for
 
 
 blueprint = Blueprint('admin', __name__, template_folder='templates', static_folder='static')
@@ -28,6 +34,8 @@ def home():
           properties:
             active:
               type: boolean
+            bit:
+              type: number
             created_at:
               type: string
             description:
@@ -36,6 +44,8 @@ def home():
               type: number
             name:
               type: string
+            version:
+              type: number
       - schema:
           id: User
           properties:
@@ -53,10 +63,12 @@ def home():
               type: string
             login_count:
               type: number
-            password:
-              type: string
+            roles_version:
+              type: number
             username:
               type: string
+            version:
+              type: number
     responses:
       200:
         description: Last updates
@@ -80,8 +92,8 @@ def home():
                 users:
                   type: number
     """
-    users, total_users = query_object_list(User, paginable=False)
-    roles, total_roles = query_object_list(Role, paginable=False)
+    users, total_users, _ = query_object_list(User, paginable=False)
+    roles, total_roles, _ = query_object_list(Role, paginable=False)
 
     data = {
         'latest': {'users': users, 'roles': roles},
@@ -91,6 +103,30 @@ def home():
     return jsonify(data), 200
 
 
+@blueprint.route('/admission', methods=['GET'])
+@login_required
+@login_permission(blueprint.name)
+def admission_stats():
+    """ Admission Stats
+
+    Show requests in flight, waiting in queue, admitted and shed by class of endpoint
+    ---
+    tags:
+      - Admin
+    responses:
+      200:
+        description: Stats by class of endpoint
+        schema:
+          id: admission_stats
+          properties:
+            classes:
+              type: object
+    """
+    controller = current_app.extensions.get('admission')
+    data = {'classes': controller.stats() if controller else {}}
+    return jsonify(data), 200
+
+
 @blueprint.route('/users', methods=['GET'])
 @login_required
 @login_permission(blueprint.name)
@@ -101,6 +137,33 @@ def users():
     ---
     tags:
       - User
+    parameters:
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
+      - name: include
+        in: query
+        type: string
+        enum: [roles]
+        description: Add roles of each user
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+      - name: after
+        in: query
+        type: string
+        description: Cursor of page, the `next` of previous page
+      - name: offset
+        in: query
+        type: integer
+        description: Rows to skip, slower in deep pages, prefer `after`
+      - name: count
+        in: query
+        type: boolean
+        default: true
+        description: Set false to skip counting of total
     responses:
       200:
         description: All users
@@ -112,9 +175,13 @@ def users():
                 $ref: "#/definitions/User"
             total:
               type: number
+            next:
+              type: string
     """
-    values, total = query_object_list(User)
-    data = {'users': values, 'total': total}
+    includes = requested_includes('roles')
+    query = User.with_roles() if includes else None
+    values, total, next_cursor = query_object_list(User, query=query, related=includes)
+    data = {'users': values, 'total': total, 'next': next_cursor}
     return jsonify(data), 200
 
 
@@ -169,6 +236,10 @@ def create_user():
         description: Conflict
         schema:
           $ref: "#/definitions/generic_error"
+      503:
+        description: Password hashing is busy
+        schema:
+          $ref: "#/definitions/generic_error"
     """
     required_fields = ('username', 'email', 'password', 'confirm_password')
     if all(request.json.get(field) for field in required_fields):
@@ -180,7 +251,8 @@ def create_user():
         return abort(400)
 
     try:
-        user = User.create(username=username, email=email, password=password, confirm_password=confirm_password)
+        user = User.create(username=username, email=email, password=password, confirm_password=confirm_password,
+                           lane=BULK)
         data = {'user': dict_object(user)}
         return jsonify(data), 201
 
@@ -190,6 +262,206 @@ def create_user():
     except UserAlreadyExist:
         abort(409)
 
+    except HashingUnavailable:
+        abort(503)
+
+
+@blueprint.route('/users/export', methods=['GET'])
+@login_required
+@login_permission(blueprint.name)
+def export_users():
+    """ Export Users
+
+    Stream all users as NDJSON, one user by line in order of id, without passwords
+    ---
+    tags:
+      - User
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: A line of JSON for each user
+        schema:
+          $ref: "#/definitions/User"
+    """
+    return ndjson_response(User)
+
+
+@blueprint.route('/users/batch', methods=['POST'])
+@login_required
+@login_permission(blueprint.name)
+def create_users():
+    """ Create Users
+
+    Create many users in a single transaction, with a result for each one
+    ---
+    tags:
+      - User
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: create_users_form
+          required:
+            - users
+          properties:
+            users:
+              type: array
+              items:
+                $ref: "#/definitions/create_edit_user_form"
+    responses:
+      200:
+        description: Result of each user, in the same order
+        schema:
+          id: create_users
+          properties:
+            results:
+              type: array
+              items:
+                properties:
+                  index:
+                    type: number
+                  status:
+                    type: string
+                    enum: [created, invalid, conflict]
+                  id:
+                    type: number
+                  error:
+                    type: string
+            created:
+              type: number
+            invalid:
+              type: number
+            conflict:
+              type: number
+      400:
+        description: Invalid json informations
+        schema:
+          $ref: "#/definitions/generic_error"
+      503:
+        description: Password hashing is busy
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    records = request.json.get('users')
+    if not records or not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        return abort(400)
+
+    if len(records) > current_app.config.get('USER_BATCH_MAX', 1000):
+        return abort(400)
+
+    try:
+        results = User.bulk_create(records)
+    except HashingUnavailable:
+        abort(503)
+
+    data = {'results': [dict(result, index=index) for index, result in enumerate(results)]}
+    for status in ('created', 'invalid', 'conflict'):
+        data[status] = sum(1 for result in results if result['status'] == status)
+    return jsonify(data), 200
+
+
+@blueprint.route('/users/batch', methods=['DELETE'])
+@login_required
+@login_permission(blueprint.name)
+def delete_users():
+    """ Delete Users
+
+    Delete many users and their memberships
+    ---
+    tags:
+      - User
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: user_ids_form
+          required:
+            - user_ids
+          properties:
+            user_ids:
+              type: array
+              items:
+                type: number
+    responses:
+      202:
+        description: Number of deleted users and memberships
+        schema:
+          id: delete_users
+          properties:
+            deleted:
+              type: number
+            removed:
+              type: number
+      400:
+        description: Invalid json informations
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    deleted, removed = User.bulk_delete(requested_user_ids())
+    data = {'deleted': deleted, 'removed': removed}
+    return jsonify(data), 202
+
+
+@blueprint.route('/users/status', methods=['POST'])
+@login_required
+@login_permission(blueprint.name)
+def set_users_status():
+    """ Set Users Status
+
+    Set **active** = `true` or `false` of many users, chosen by ids or by a filter
+    ---
+    tags:
+      - User
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: users_status_form
+          required:
+            - active
+          properties:
+            active:
+              type: boolean
+            user_ids:
+              type: array
+              items:
+                type: number
+            filter:
+              properties:
+                email_domain:
+                  type: string
+    responses:
+      202:
+        description: Number of changed users
+        schema:
+          id: users_status
+          properties:
+            updated:
+              type: number
+      400:
+        description: Invalid json informations
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    body = request.get_json(silent=True) or {}
+    active = body.get('active')
+    if not isinstance(active, bool):
+        return abort(400)
+
+    if 'user_ids' in body:
+        updated = User.set_active(active, user_ids=requested_user_ids())
+    elif isinstance(body.get('filter'), dict) and body['filter'].get('email_domain'):
+        updated = User.set_active(active, email_domain=str(body['filter']['email_domain']))
+    else:
+        return abort(400)
+
+    data = {'updated': updated}
+    return jsonify(data), 202
+
 
 @blueprint.route('/users/<user_id>', methods=['GET'])
 @login_required
@@ -206,6 +478,10 @@ def show_user(user_id):
         in: path
         type: string
         required: true
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
     responses:
       200:
         decription: show user
@@ -230,8 +506,6 @@ def show_user(user_id):
                     type: string
                   login_count:
                     type: number
-                  password:
-                    type: string
                   username:
                     type: string
                   roles:
@@ -243,11 +517,12 @@ def show_user(user_id):
         schema:
           $ref: "#/definitions/generic_error"
     """
-    user = User.query.get(user_id)
+    fields = requested_fields(User)
+    user = User.with_roles(load_fields(User.query, fields)).get(user_id)
     if not user:
         abort(404)
 
-    data = {'user': dict_object(user)}
+    data = {'user': dict_object(user, fields)}
     data['user']['roles'] = dict_list(user.roles)
     return jsonify(data), 200
 
@@ -290,6 +565,64 @@ def toogle_user_status(user_id):
     return jsonify(data), 202
 
 
+@blueprint.route('/users/<user_id>', methods=['PATCH'])
+@login_required
+@login_permission(blueprint.name)
+def patch_user(user_id):
+    """ Patch User
+
+    Change only given fields of a user, `username`, `email` or `active`. When sent with header `If-Match`
+    (ETag of a previous response), user is only changed if it's still in that version
+    ---
+    tags:
+      - User
+    parameters:
+      - name: user_id
+        in: path
+        type: string
+        required: true
+      - name: If-Match
+        in: header
+        type: string
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: patch_user_form
+          properties:
+            username:
+              type: string
+            email:
+              type: string
+            active:
+              type: boolean
+    responses:
+      200:
+        description: Patched user
+        schema:
+          properties:
+            user:
+              $ref: "#/definitions/User"
+      400:
+        description: Unknown field or invalid value
+        schema:
+          $ref: "#/definitions/generic_error"
+      404:
+        description: Not Found
+        schema:
+          $ref: "#/definitions/generic_error"
+      409:
+        description: Username or email already used
+        schema:
+          $ref: "#/definitions/generic_error"
+      412:
+        description: User changed since version of If-Match
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    return patch_response(User, user_id, 'user')
+
+
 @blueprint.route('/users/<user_id>/roles', methods=['GET'])
 @login_required
 @login_permission(blueprint.name)
@@ -306,6 +639,27 @@ def show_user_roles(user_id):
         type: string
         required: true
         required: true
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+      - name: after
+        in: query
+        type: string
+        description: Cursor of page, the `next` of previous page
+      - name: offset
+        in: query
+        type: integer
+        description: Rows to skip, slower in deep pages, prefer `after`
+      - name: count
+        in: query
+        type: boolean
+        default: true
+        description: Set false to skip counting of total
     responses:
       200:
         description: Create User
@@ -325,7 +679,8 @@ def show_user_roles(user_id):
     if not user:
         abort(404)
 
-    data = {'roles': dict_list(user.roles)}
+    values, total, next_cursor = query_object_list(Role, query=user.roles_query(), descending=False)
+    data = {'roles': values, 'total': total, 'next': next_cursor}
     return jsonify(data), 200
 
 
@@ -335,7 +690,7 @@ def show_user_roles(user_id):
 def delete_user_roles(user_id):
     """ Remove All User's Role
 
-    Remove all roles of a user
+    Remove all roles of a user, `removed` is the number of removed roles
     ---
     tags:
       - User
@@ -360,9 +715,9 @@ def delete_user_roles(user_id):
         abort(404)
 
     try:
-        user.delete_all_roles()
+        removed = user.delete_all_roles()
         user.refresh()
-        data = {'user': dict_object(user)}
+        data = {'user': dict_object(user), 'removed': removed}
         data['user']['roles'] = dict_list(user.roles)
         return jsonify(data), 202
     except UserNotHasRole:
@@ -475,6 +830,33 @@ def roles():
     ---
     tags:
       - Role
+    parameters:
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
+      - name: include
+        in: query
+        type: string
+        enum: [users]
+        description: Add users of each role
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+      - name: after
+        in: query
+        type: string
+        description: Cursor of page, the `next` of previous page
+      - name: offset
+        in: query
+        type: integer
+        description: Rows to skip, slower in deep pages, prefer `after`
+      - name: count
+        in: query
+        type: boolean
+        default: true
+        description: Set false to skip counting of total
     responses:
       200:
         description: All roles
@@ -486,14 +868,37 @@ def roles():
                 $ref: "#/definitions/Role"
             total:
               type: number
+            next:
+              type: string
     """
-    login_permission([blueprint.name])
-
-    values, total = query_object_list(Role)
-    data = {'roles': values, 'total': total}
+    includes = requested_includes('users')
+    query = Role.with_users() if includes else None
+    values, total, next_cursor = query_object_list(Role, query=query, related=includes)
+    data = {'roles': values, 'total': total, 'next': next_cursor}
     return jsonify(data), 200
 
 
+@blueprint.route('/roles/export', methods=['GET'])
+@login_required
+@login_permission(blueprint.name)
+def export_roles():
+    """ Export Roles
+
+    Stream all roles as NDJSON, one role by line in order of id
+    ---
+    tags:
+      - Role
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: A line of JSON for each role
+        schema:
+          $ref: "#/definitions/Role"
+    """
+    return ndjson_response(Role)
+
+
 @blueprint.route('/roles', methods=['POST'])
 @login_required
 @login_permission(blueprint.name)
@@ -563,7 +968,7 @@ def create_role():
 def show_role(role_id):
     """ Show Role
 
-    Show a single role
+    Show a single role with a page of its users
     ---
     tags:
       - Role
@@ -572,6 +977,19 @@ def show_role(role_id):
         in: path
         type: string
         required: true
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+        description: Users in page of users of role
+      - name: after
+        in: query
+        type: string
+        description: Cursor of page of users, the `users_next` of previous page
     responses:
       200:
         decription: show_role
@@ -596,17 +1014,23 @@ def show_role(role_id):
                     type: array
                     items:
                       $ref: "#/definitions/User"
+                  users_total:
+                    type: number
+                  users_next:
+                    type: string
       404:
         description: Not Found
         schema:
           $ref: "#/definitions/generic_error"
     """
-    role = Role.query.get(role_id)
+    fields = requested_fields(Role)
+    role = load_fields(Role.query, fields).get(role_id)
     if not role:
         abort(404)
 
-    data = {'role': dict_object(role)}
-    data['role']['users'] = dict_list(role.users)
+    data = {'role': dict_object(role, fields)}
+    users, total, next_cursor = query_object_list(User, query=role.users_query(), descending=False, sparse=False)
+    data['role'].update(users=users, users_total=total, users_next=next_cursor)
     return jsonify(data), 200
 
 
@@ -625,6 +1049,27 @@ def show_role_users(role_id):
         in: path
         type: string
         required: true
+      - name: fields
+        in: query
+        type: string
+        description: Comma separated fields to return, e.g. id,username,active
+      - name: limit
+        in: query
+        type: integer
+        default: 10
+      - name: after
+        in: query
+        type: string
+        description: Cursor of page, the `next` of previous page
+      - name: offset
+        in: query
+        type: integer
+        description: Rows to skip, slower in deep pages, prefer `after`
+      - name: count
+        in: query
+        type: boolean
+        default: true
+        description: Set false to skip counting of total
     responses:
       200:
         decription: show_role
@@ -644,10 +1089,129 @@ def show_role_users(role_id):
     if not role:
         abort(404)
 
-    data = {'users': dict_list(role.users)}
+    values, total, next_cursor = query_object_list(User, query=role.users_query(), descending=False)
+    data = {'users': values, 'total': total, 'next': next_cursor}
     return jsonify(data), 200
 
 
+@blueprint.route('/roles/<role_id>/users', methods=['POST'])
+@login_required
+@login_permission(blueprint.name)
+def assign_role_users(role_id):
+    """ Assign Role to Users
+
+    Add many users to role, users already in role are skipped
+    ---
+    tags:
+      - Permissions
+    parameters:
+      - name: role_id
+        in: path
+        type: string
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: role_users_form
+          required:
+            - user_ids
+          properties:
+            user_ids:
+              type: array
+              items:
+                type: number
+    responses:
+      201:
+        description: Number of users added to role and ids of users not found
+        schema:
+          id: assign_role_users
+          properties:
+            role:
+              schema:
+                $ref: "#/definitions/Role"
+            inserted:
+              type: number
+            missing:
+              type: array
+              items:
+                type: number
+      400:
+        description: Invalid json informations
+        schema:
+          $ref: "#/definitions/generic_error"
+      404:
+        description: Not Found
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    user_ids = requested_user_ids()
+    role = Role.query.get(role_id)
+    if not role:
+        abort(404)
+
+    inserted, missing = UserRole.assign(role.id, user_ids)
+    db.session.commit()
+    # Bulk statements are not seen by models_committed
+    invalidation_bus.publish(users=set(user_ids) - set(missing))
+
+    data = {'role': dict_object(role), 'inserted': inserted, 'missing': missing}
+    return jsonify(data), 201
+
+
+@blueprint.route('/roles/<role_id>/users/batch', methods=['DELETE'])
+@login_required
+@login_permission(blueprint.name)
+def revoke_role_users(role_id):
+    """ Revoke Role of Users
+
+    Remove many users of role
+    ---
+    tags:
+      - Permissions
+    parameters:
+      - name: role_id
+        in: path
+        type: string
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          $ref: "#/definitions/role_users_form"
+    responses:
+      202:
+        description: Number of users removed of role
+        schema:
+          id: revoke_role_users
+          properties:
+            role:
+              schema:
+                $ref: "#/definitions/Role"
+            removed:
+              type: number
+      400:
+        description: Invalid json informations
+        schema:
+          $ref: "#/definitions/generic_error"
+      404:
+        description: Not Found
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    user_ids = requested_user_ids()
+    role = Role.query.get(role_id)
+    if not role:
+        abort(404)
+
+    removed = UserRole.remove(role_id=role.id, user_ids=user_ids)
+    db.session.commit()
+    invalidation_bus.publish(users=user_ids)
+
+    data = {'role': dict_object(role), 'removed': removed}
+    return jsonify(data), 202
+
+
 @blueprint.route('/roles/<role_id>', methods=['POST'])
 @login_required
 @login_permission(blueprint.name)
@@ -709,13 +1273,71 @@ def edit_role(role_id):
         abort(409)
 
 
+@blueprint.route('/roles/<role_id>', methods=['PATCH'])
+@login_required
+@login_permission(blueprint.name)
+def patch_role(role_id):
+    """ Patch Role
+
+    Change only given fields of a role, `name`, `description` or `active`. When sent with header `If-Match`
+    (ETag of a previous response), role is only changed if it's still in that version
+    ---
+    tags:
+      - Role
+    parameters:
+      - name: role_id
+        in: path
+        type: string
+        required: true
+      - name: If-Match
+        in: header
+        type: string
+      - in: body
+        name: body
+        required: true
+        schema:
+          id: patch_role_form
+          properties:
+            name:
+              type: string
+            description:
+              type: string
+            active:
+              type: boolean
+    responses:
+      200:
+        description: Patched role
+        schema:
+          properties:
+            role:
+              $ref: "#/definitions/Role"
+      400:
+        description: Unknown field or invalid value
+        schema:
+          $ref: "#/definitions/generic_error"
+      404:
+        description: Not Found
+        schema:
+          $ref: "#/definitions/generic_error"
+      409:
+        description: Name already used
+        schema:
+          $ref: "#/definitions/generic_error"
+      412:
+        description: Role changed since version of If-Match
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    return patch_response(Role, role_id, 'role')
+
+
 @blueprint.route('/roles/<role_id>', methods=['DELETE'])
 @login_required
 @login_permission(blueprint.name)
 def delete_role(role_id):
     """ Delete Role
 
-    Show all roles in base
+    Delete a role and its memberships, show first page of roles and number of `removed` users
     ---
     tags:
       - Role
@@ -734,11 +1356,11 @@ def delete_role(role_id):
     if not role:
         abort(404)
 
-    role.remove_all_users()
+    removed = role.remove_all_users(commit=False)
     role.delete(commit=True)
 
-    values, total = query_object_list(Role)
-    data = {'roles': values, 'total': total}
+    values, total, next_cursor = query_object_list(Role)
+    data = {'roles': values, 'total': total, 'next': next_cursor, 'removed': removed}
     return jsonify(data), 202
 
 
@@ -748,7 +1370,7 @@ def delete_role(role_id):
 def remove_all_users(role_id):
     """ Remove All Role's User
 
-    Remove all users of a role
+    Remove all users of a role, `removed` is the number of removed users
     ---
     tags:
       - Role
@@ -771,9 +1393,61 @@ def remove_all_users(role_id):
     if not role:
         abort(404)
 
-    role.remove_all_users()
+    removed = role.remove_all_users()
     role.refresh()
 
-    data = {'role': dict_object(role)}
+    data = {'role': dict_object(role), 'removed': removed}
     data['role']['users'] = dict_list(role.users)
     return jsonify(data), 202
+
+
+def ndjson_response(model):
+    chunk_size = current_app.config.get('EXPORT_CHUNK_SIZE', 1000)
+    return Response(stream_with_context(export_lines(model, chunk_size=chunk_size)), mimetype='application/x-ndjson')
+
+
+def requested_user_ids():
+    """Return `user_ids` of json body, a bad request when it's not a list of ids or it's too long"""
+    user_ids = (request.get_json(silent=True) or {}).get('user_ids')
+    if (not user_ids or not isinstance(user_ids, list) or
+            not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids) or
+            len(user_ids) > current_app.config.get('USER_BATCH_MAX', 1000)):
+        abort(400)
+    return user_ids
+
+
+def patch_response(model, object_id, key):
+    """Patch a row of model with json body and `If-Match` version, without loading it first"""
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict):
+        abort(400)
+    try:
+        object_id = int(object_id)
+    except ValueError:
+        abort(404)
+
+    try:
+        row = model.patch(object_id, values, version=requested_version())
+    except (InvalidPatch, InvalidUsername, InvalidEmail, InvalidRoleName):
+        return abort(400)
+    except (UserNotFound, RoleNotFound):
+        return abort(404)
+    except (UserAlreadyExist, RoleAlreadyExist):
+        return abort(409)
+    except VersionConflict:
+        return abort(412)
+
+    response = jsonify({key: serializer_for(model)(row)})
+    response.set_etag(str(row['version']))
+    return response
+
+
+def requested_version():
+    """Return version of `If-Match` header, None when it's missing or `*`"""
+    etags = request.if_match
+    if not etags or etags.star_tag:
+        return None
+    versions = [etag for etag in etags if etag.isdigit()]
+    if len(versions) != 1:
+        abort(412)
+    return int(versions[0])
@@ -1,13 +1,14 @@
 # coding: utf-8
 """The views of login, change password and common views are here"""
-from flask import Blueprint, request, current_app, render_template, abort
+from flask import Blueprint, request, current_app, render_template, abort, session
 from flask_login import login_required, login_user, logout_user, current_user
 from flask_swagger import swagger
 from flask.json import jsonify
 
-from auth.exceptions import UserNotFound, InvalidPassword, InvalidCredentials, PasswordMismatch
-from auth.views import login_permission
+from auth.exceptions import UserNotFound, InvalidPassword, InvalidCredentials, PasswordMismatch, HashingUnavailable
+from auth.views import login_permission, store_role_mask
 from auth.models import User
+from auth.throttle import login_throttle
 
 
 blueprint = Blueprint('core', __name__, template_folder='templates', static_folder='static')
@@ -91,6 +92,14 @@ def login():
         description: User not found
         schema:
           $ref: "#/definitions/generic_error"
+      429:
+        description: Too many login attempts
+        schema:
+          $ref: "#/definitions/generic_error"
+      503:
+        description: Password hashing is busy
+        schema:
+          $ref: "#/definitions/generic_error"
     """
     required_fields = ('username', 'password')
     if all(request.json.get(field) for field in required_fields):
@@ -100,10 +109,20 @@ def login():
     else:
         return abort(400)
 
+    login_throttle.hit(username, request.remote_addr)
+
     try:
         user = User.by_login(username)
         if user.validate_password(password):
+            if user.password_needs_rehash():
+                try:
+                    user.upgrade_password(password)
+                except HashingUnavailable:
+                    # Password is right, its hash is upgraded at next login
+                    current_app.logger.warning('Could not upgrade password hash of user %s', user.id)
             login_user(user, remember)
+            if current_app.config.get('PERMISSION_SESSION_MASK'):
+                store_role_mask(user)
             return jsonify({'message': 'success'}), 200
         else:
             return abort(401)
@@ -111,6 +130,44 @@ def login():
     except UserNotFound:
         return abort(404)
 
+    except HashingUnavailable:
+        return abort(503)
+
+
+@blueprint.route('/users/available', methods=['GET'])
+def username_available():
+    """Username available
+
+    **Check if a username is not used by any user**
+    ---
+    tags:
+      - Core
+    parameters:
+      - name: username
+        in: query
+        type: string
+        required: true
+    responses:
+      200:
+        description: Availability of username
+        schema:
+          id: username_available
+          properties:
+            username:
+              type: string
+            available:
+              type: boolean
+      400:
+        description: Invalid username
+        schema:
+          $ref: "#/definitions/generic_error"
+    """
+    username = request.args.get('username', '')
+    if not User.verify_username(username):
+        return abort(400)
+
+    return jsonify({'username': username, 'available': User.is_available(username)}), 200
+
 
 @blueprint.route('/home', methods=['GET'])
 @login_required
@@ -177,6 +234,7 @@ def logout():
           $ref: "#/definitions/generic_success"
     """
     logout_user()
+    session.pop('roles', None)
     return jsonify({'message': 'success'}), 200
 
 
@@ -222,6 +280,10 @@ def change_password():
         description: Invalid credentials
         schema:
           $ref: "#/definitions/generic_error"
+      503:
+        description: Password hashing is busy
+        schema:
+          $ref: "#/definitions/generic_error"
     """
     required_fields = ('old_password', 'password', 'confirm_password')
     if all(request.json.get(field) for field in required_fields):
@@ -241,3 +303,6 @@ def change_password():
 
     except InvalidCredentials:
         return abort(401)
+
+    except HashingUnavailable:
+        return abort(503)
@@ -0,0 +1,50 @@
+# coding: utf-8
+"""Rows serialized by second of 10k-row pages, old `dict_object` against compiled serializers.
+
+Run with `PYTHONPATH=. python benchmarks/serializers.py`, objects are built in memory, no database is used.
+"""
+import os
+import timeit
+from collections import OrderedDict
+from datetime import datetime
+
+os.environ.setdefault('AUTH_ENV', 'test')
+
+from auth.models import User  # noqa
+from auth.serializers import serialize_list  # noqa
+
+ROWS = 10000
+REPEAT = 5
+
+
+def dict_object(query_object):
+    """Serialization of each row before serializers"""
+    result = OrderedDict()
+    for key in query_object.__mapper__.c.keys():
+        result[key] = getattr(query_object, key)
+
+        if isinstance(result[key], datetime):
+            result[key] = getattr(query_object, key).strftime('%d/%m/%Y %H:%M:%S')
+    return result
+
+
+def users():
+    now = datetime.now()
+    return [User(id=index, username='user{}'.format(index), email='user{}@example.com'.format(index),
+                 password='pbkdf2:sha256:150000$salt$' + 'f' * 64, active=True, created_at=now, last_login_at=now,
+                 current_login_at=now, login_count=index, roles_version=0) for index in range(ROWS)]
+
+
+def rate(function, page):
+    seconds = min(timeit.repeat(lambda: function(page), number=1, repeat=REPEAT))
+    return ROWS / seconds
+
+
+def main():
+    page = users()
+    print('dict_object  {:>10.0f} rows/s'.format(rate(lambda rows: [dict_object(row) for row in rows], page)))
+    print('serializers  {:>10.0f} rows/s'.format(rate(serialize_list, page)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 # coding: utf-8
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
+from auth.commands import ImportCommand, ExportCommand
 from auth.main import create_app, db
 
 app = create_app()
@@ -8,6 +9,8 @@ manager = Manager(app)
 migrate = Migrate(app=app, db=db)
 
 manager.add_command('db', MigrateCommand)
+manager.add_command('import', ImportCommand())
+manager.add_command('export', ExportCommand())
 
 
 if __name__ == '__main__':
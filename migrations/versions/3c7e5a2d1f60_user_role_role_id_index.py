@@ -0,0 +1,23 @@
+"""user_role_role_id_index
+
+Revision ID: 3c7e5a2d1f60
+Revises: 8f2d4c1a9b3e
+Create Date: 2026-10-18 14:03:27.518204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c7e5a2d1f60'
+down_revision = '8f2d4c1a9b3e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Unique index of (user_id, role_id) can't be used to search members of a role
+    op.create_index(op.f('ix_user_role_role_id'), 'user_role', ['role_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_role_role_id'), table_name='user_role')
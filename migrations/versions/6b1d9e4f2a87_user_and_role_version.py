@@ -0,0 +1,25 @@
+"""user_and_role_version
+
+Revision ID: 6b1d9e4f2a87
+Revises: 3c7e5a2d1f60
+Create Date: 2026-10-18 16:41:09.331870
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b1d9e4f2a87'
+down_revision = '3c7e5a2d1f60'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Version of patchable fields, checked by PATCH requests sent with If-Match
+    op.add_column('user', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('role', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('role', 'version')
+    op.drop_column('user', 'version')
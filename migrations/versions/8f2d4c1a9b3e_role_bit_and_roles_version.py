@@ -0,0 +1,33 @@
+"""role_bit_and_roles_version
+
+Revision ID: 8f2d4c1a9b3e
+Revises: 5336b18ea727
+Create Date: 2026-10-18 09:12:44.120387
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4c1a9b3e'
+down_revision = '5336b18ea727'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('role', sa.Column('bit', sa.Integer(), nullable=True))
+    op.add_column('user', sa.Column('roles_version', sa.Integer(), nullable=False, server_default='0'))
+
+    # Existing roles receive bit slots in order of creation
+    connection = op.get_bind()
+    role_ids = [row[0] for row in connection.execute(sa.text('SELECT id FROM role ORDER BY id'))]
+    for bit, role_id in enumerate(role_ids):
+        connection.execute(sa.text('UPDATE role SET bit = :bit WHERE id = :id'), bit=bit, id=role_id)
+
+    op.create_unique_constraint('un_role_bit', 'role', ['bit'])
+
+
+def downgrade():
+    op.drop_constraint('un_role_bit', 'role', type_='unique')
+    op.drop_column('user', 'roles_version')
+    op.drop_column('role', 'bit')
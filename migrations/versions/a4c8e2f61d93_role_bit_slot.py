@@ -0,0 +1,27 @@
+"""role_bit_slot
+
+Revision ID: a4c8e2f61d93
+Revises: 6b1d9e4f2a87
+Create Date: 2026-10-19 10:22:51.604118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e2f61d93'
+down_revision = '6b1d9e4f2a87'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('role_bit_slot',
+    sa.Column('bit', sa.Integer(), autoincrement=False, nullable=False),
+    sa.PrimaryKeyConstraint('bit')
+    )
+    # Slots of existing roles are taken, new roles get slots above the highest of them
+    op.execute('INSERT INTO role_bit_slot (bit) SELECT bit FROM role WHERE bit IS NOT NULL')
+
+
+def downgrade():
+    op.drop_table('role_bit_slot')
@@ -84,6 +84,12 @@ def database(session_app):
 
 @pytest.yield_fixture()
 def db_session(database, app):
+    from auth.bloom import login_filter
+    from auth.cache import permission_cache, role_bits, count_cache
+    permission_cache.clear()
+    role_bits.clear()
+    count_cache.clear()
+    login_filter.reset()
     db.session.original_remove()
     db.session.begin(subtransactions=True)
     yield db.session
@@ -196,6 +202,17 @@ def client(app):
         yield _client
 
 
+@pytest.fixture
+def stream_client(app, client):
+    """
+    Client sharing cookies of ``client`` which doesn't preserve request context, so the context kept by
+    streamed responses is popped when they're read.
+    """
+    _client = app.test_client()
+    _client.cookie_jar = client.cookie_jar
+    return _client
+
+
 @pytest.fixture
 def header():
     return {'Content-Type': 'application/json; charset=UTF-8'}
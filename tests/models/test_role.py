@@ -1,7 +1,7 @@
 # coding: utf-8
 import pytest
-from auth.exceptions import RoleNotFound, RoleAlreadyExist, InvalidRoleName
-from auth.models import Role
+from auth.exceptions import RoleNotFound, RoleAlreadyExist, InvalidRoleName, InvalidPatch, VersionConflict
+from auth.models import Role, User, execute_unique
 
 
 def test_create_role_with_success():
@@ -54,3 +54,77 @@ def test_search_role_with_part_of_name(role):
 def test_search_role_do_not_return_a_role():
     with pytest.raises(RoleNotFound):
         Role.search_role(name='Inexist role', exactly=True)
+
+
+def test_role_users_query(user, other_user, role, admin_role, other_user_in_role):
+    assert role.users_query().order_by(User.id).all() == [user, other_user]
+    assert role.users_query().filter(User.username == 'Luke_Skywalker').count() == 1
+
+
+def test_rename_to_taken_name_keeps_role(role, role_user):
+    with pytest.raises(RoleAlreadyExist):
+        role_user.edit(name='admin')
+    assert Role.query.get(role_user.id).name == 'user'
+
+
+def test_created_role_has_bit(role):
+    created = Role.create(name='review')
+    assert created.bit is not None and created.bit != role.bit
+
+
+def test_bit_of_deleted_role_is_not_given_again(role):
+    deleted = Role.create(name='review')
+    bit = deleted.bit
+    deleted.delete()
+    created = Role.create(name='newsletter')
+    assert created.bit > bit
+
+
+def test_conflicting_create_does_not_reserve_a_bit(role):
+    for _ in range(5):
+        with pytest.raises(RoleAlreadyExist):
+            Role.create(name='admin')
+    assert Role.create(name='review').bit == role.bit + 1
+
+
+def test_create_role_when_bit_was_taken_meanwhile(role, monkeypatch):
+    # A concurrent create reserved the slot read as free
+    monkeypatch.setattr(Role, 'last_bit', staticmethod(lambda connection: role.bit - 1))
+    created = Role.create(name='review')
+    assert created.bit == role.bit + 1
+
+
+def test_patch_role_bumps_version_of_row_and_users(role, role_user, user_role, user):
+    roles_version = user.roles_version
+    row = Role.patch(role_user.id, {'active': False}, version=role_user.version)
+    assert (row['active'], row['version']) == (False, 1)
+    assert Role.query.get(role_user.id).active is False
+    assert User.query.get(user.id).roles_version == roles_version + 1
+
+
+@pytest.mark.parametrize('exception, values, version', [
+    (RoleAlreadyExist, {'name': 'admin'}, None),
+    (InvalidRoleName, {'name': 'ad'}, None),
+    (InvalidPatch, {'bit': 3}, None),
+    (InvalidPatch, {'active': 'no'}, None),
+    (VersionConflict, {'description': 'Late'}, 7)
+])
+def test_should_not_patch_role(role, role_user, exception, values, version):
+    with pytest.raises(exception):
+        Role.patch(role_user.id, values, version=version)
+    assert Role.query.get(role_user.id).version == 0
+
+
+def test_should_not_patch_inexistent_role():
+    with pytest.raises(RoleNotFound):
+        Role.patch(100, {'description': 'Nobody'})
+
+
+def test_unique_conflict_passing_guard_keeps_session_usable(role, role_user):
+    # Same as a concurrent rename committed after the NOT EXISTS guard was checked
+    table = Role.__table__
+    with pytest.raises(RoleAlreadyExist):
+        execute_unique(table.update().where(table.c.id == role_user.id).values(name='admin'), RoleAlreadyExist)
+    assert Role.query.get(role_user.id).name == 'user'
+    role_user.edit(name='review')
+    assert Role.query.get(role_user.id).name == 'review'
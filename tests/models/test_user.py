@@ -1,7 +1,7 @@
 # coding: utf-8
 import pytest
 from auth.exceptions import (UserAlreadyExist, InvalidUsername, InvalidEmail, InvalidPassword, PasswordMismatch,
-                             UserNotFound, InvalidCredentials)
+                             UserNotFound, InvalidCredentials, VersionConflict)
 from auth.models import User
 
 
@@ -68,3 +68,63 @@ def test_invalidate_and_validate_user(user):
     assert user.active is False
     user.toggle_status()
     assert user.active is True
+
+
+def test_bulk_create_users_with_result_by_record(user):
+    results = User.bulk_create([
+        {'username': 'Han_Solo', 'email': 'han@sw.com', 'password': '12345678'},
+        {'username': 'Chewbacca', 'email': 'chewie@sw.com', 'password': '123'},
+        {'username': 'Darth_Vader', 'email': 'other@sw.com', 'password': '12345678'},
+        {'username': 'Han_Solo', 'email': 'solo@sw.com', 'password': '12345678'},
+        {'username': 'Leia', 'email': 'leia@sw.com', 'password': '12345678', 'confirm_password': '87654321'},
+    ])
+    assert [result['status'] for result in results] == ['created', 'invalid', 'conflict', 'conflict', 'invalid']
+    assert results[1]['error'] == 'invalid_password'
+    assert results[4]['error'] == 'password_mismatch'
+
+    created = User.query.get(results[0]['id'])
+    assert created.username == 'Han_Solo'
+    assert created.validate_password('12345678')
+    assert not User.is_available('han@sw.com')
+
+
+def test_conflicting_user_keeps_session_usable(user):
+    with pytest.raises(UserAlreadyExist):
+        User.create(username='Han_Solo', email='mayforce@bewith.you', password='12345678',
+                    confirm_password='12345678')
+    assert User.query.count() == 1
+
+
+def test_insert_or_nothing_returns_none_on_conflict(user):
+    from auth.models import insert_or_nothing
+    assert insert_or_nothing(User, {'username': 'Darth_Vader', 'email': 'other@sw.com'}) is None
+    assert insert_or_nothing(User, {'username': 'Han_Solo', 'email': 'han@sw.com'}) is not None
+    assert User.query.count() == 2
+
+
+def test_set_active_by_email_domain_escapes_wildcards(user, other_user):
+    assert User.set_active(False, email_domain='%') == 0
+    assert User.set_active(False, email_domain='bewith.you') == 1
+    assert User.set_active(False, email_domain='bewith.you') == 0
+    assert user.active is False
+
+
+def test_patch_user_changes_only_given_fields(user):
+    row = User.patch(user.id, {'email': 'vader@empire.gov'}, version=0)
+    assert (row['username'], row['email'], row['version']) == ('Darth_Vader', 'vader@empire.gov', 1)
+    assert User.query.get(user.id).email == 'vader@empire.gov'
+    assert not User.is_available('vader@empire.gov')
+
+
+def test_orm_change_of_patchable_fields_increments_version_in_sql(user):
+    User.query.filter(User.id == user.id).update({User.version: 5}, synchronize_session=False)
+    # Object still holds version 0, database increments the current one
+    user.toggle_status()
+    assert user.version == 6
+
+
+def test_orm_change_of_patchable_fields_makes_new_version(user):
+    user.toggle_status()
+    assert user.version == 1
+    with pytest.raises(VersionConflict):
+        User.patch(user.id, {'active': True}, version=0)
@@ -36,3 +36,43 @@ def test_remove_all_users_of_a_role(role, user, admin_role, other_user, other_us
     assert len(role.users) == 0
 
 
+def test_user_has_role_named(user, role_user, user_role):
+    assert user.has_role_named('user') is True
+    assert user.has_role_named('admin') is None
+
+
+def test_user_has_not_inactive_role_named(user, role_user, user_role):
+    role_user.toggle_status()
+    assert user.has_role_named('user') is None
+
+
+def test_remove_all_users_with_single_statement(role, user, admin_role, other_user, other_user_in_role):
+    from auth.cache import permission_cache
+    from auth.models import User
+    permission_cache.set(other_user.id, [(role.id, role.name)])
+    version = other_user.roles_version
+
+    assert role.remove_all_users() == 2
+    assert UserRole.query.filter(UserRole.role_id == role.id).count() == 0
+    assert permission_cache.get(other_user.id) is None
+    assert User.query.get(other_user.id).roles_version == version + 1
+    assert other_user.roles == []
+
+
+def test_remove_only_memberships_of_users(user, other_user, role, admin_role, other_user_in_role):
+    assert UserRole.remove(role_id=role.id, user_ids=[other_user.id]) == 1
+    assert [role_user.user for role_user in role.role_users] == [user]
+
+
+def test_assign_role_to_users_skips_members(user, other_user, role, admin_role):
+    from auth.models import User
+    version = other_user.roles_version
+    assert UserRole.assign(role.id, [user.id, other_user.id]) == (1, [])
+    assert User.query.get(other_user.id).roles_version == version + 1
+    assert other_user.has_role(role) is True
+
+
+def test_duplicate_user_role_keeps_session_usable(user, role, admin_role):
+    with pytest.raises(UserAlreadyInRole):
+        UserRole.set_role(user, role)
+    assert UserRole.query.filter_by(user_id=user.id).count() == 1
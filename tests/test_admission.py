@@ -0,0 +1,76 @@
+# coding: utf-8
+import json
+import threading
+import pytest
+from flask import Flask, url_for
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from auth.admission import AdmissionController, EndpointClass, admission
+
+
+def test_endpoint_class_shed_after_queue_timeout():
+    endpoint_class = EndpointClass('hash', limit=1, queue_timeout=0.01)
+    assert endpoint_class.enter() is True
+    assert endpoint_class.enter() is False
+    endpoint_class.leave()
+    assert endpoint_class.enter() is True
+    assert endpoint_class.stats() == {'limit': 1, 'in_flight': 1, 'waiting': 0, 'admitted': 2, 'shed': 1}
+
+
+def test_endpoint_class_shed_when_queue_is_full():
+    endpoint_class = EndpointClass('hash', limit=1, queue_timeout=10, queue_size=0)
+    endpoint_class.enter()
+    assert endpoint_class.enter() is False
+
+
+@pytest.fixture
+def blocking_app():
+    release = threading.Event()
+    started = threading.Event()
+    app = Flask('auth.main')
+    app.config['ADMISSION_LIMITS'] = {'hash': (1, 0.05)}
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        started.set()
+        release.wait(5)
+        return 'ok'
+
+    AdmissionController(app)
+    return app, started, release
+
+
+def test_admission_controller_return_503_with_retry_after(blocking_app):
+    app, started, release = blocking_app
+    thread = threading.Thread(target=Client(app, Response).post, args=('/login',))
+    thread.start()
+    started.wait(5)
+
+    response = Client(app, Response).post('/login')
+    release.set()
+    thread.join()
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert json.loads(response.data.decode('utf-8'))['error_code'] == 'service_unavailable'
+    assert app.extensions['admission'].stats()['hash']['shed'] == 1
+
+
+def test_each_app_has_its_own_middleware():
+    apps = []
+    for name in ('one', 'two'):
+        app = Flask('auth.main')
+        app.config['ADMISSION_LIMITS'] = {'read': (1, 0.05)}
+        app.add_url_rule('/', name, lambda name=name: name)
+        admission.init_app(app)
+        apps.append(app)
+
+    assert [Client(app, Response).get('/').data for app in apps] == [b'one', b'two']
+    assert apps[0].extensions['admission'] is not apps[1].extensions['admission']
+
+
+def test_admission_stats_view(client, admin_login):
+    response = client.get(url_for('admin.admission_stats'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['classes'] == {}
+    assert response.status_code == 200
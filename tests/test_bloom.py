@@ -0,0 +1,33 @@
+# coding: utf-8
+from auth.bloom import BloomFilter, login_filter
+from auth.models import db, User
+
+
+def test_bloom_filter_contains_added_values():
+    bloom = BloomFilter(100)
+    for index in range(100):
+        bloom.add('user{}'.format(index))
+    assert all('user{}'.format(index) in bloom for index in range(100))
+    assert sum('other{}'.format(index) in bloom for index in range(1000)) < 10
+
+
+def test_login_filter_knows_inserted_users(user):
+    assert login_filter.might_contain('Darth_Vader') is True
+    assert login_filter.might_contain('Luke_Skywalker') is False
+    User.create(username='Luke_Skywalker', email='luke@sw.com', password='123456', confirm_password='123456')
+    assert login_filter.might_contain('Luke_Skywalker') is True
+    assert login_filter.might_contain('luke@sw.com') is True
+
+
+def test_login_filter_load_users_changed_by_other_workers(user):
+    assert login_filter.might_contain('Han_Solo') is False
+    User.query.filter(User.id == user.id).update({User.username: 'Han_Solo'})
+    login_filter.on_change('user', user.id)
+    assert login_filter.might_contain('Han_Solo') is True
+
+
+def test_login_filter_finds_users_inserted_by_other_processes(user):
+    assert login_filter.might_contain('Darth_Vader') is True
+    db.session.execute(User.__table__.insert().values(username='imported', email='imported@sw.com', password='x'))
+    assert login_filter.might_contain('imported') is True
+    assert User.by_login('imported').email == 'imported@sw.com'
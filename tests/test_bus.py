@@ -0,0 +1,109 @@
+# coding: utf-8
+import time
+from flask import Flask
+from flask_sqlalchemy import models_committed
+from auth.bus import (InvalidationBus, MemoryTransport, PostgresTransport, UnixSocketTransport, decode_keys, encode_keys,
+                      split_payload)
+from auth.cache import permission_cache, evict_all
+
+
+def test_encode_and_decode_keys():
+    keys = {('user', 1), ('role', 20)}
+    assert decode_keys(encode_keys(keys)) == keys
+
+
+def test_split_payload_in_chunks():
+    chunks = list(split_payload('user:1,user:2,user:3', 13))
+    assert chunks == ['user:1,user:2', 'user:3']
+
+
+def test_memory_transport_deliver_to_other_workers():
+    received = []
+    worker = InvalidationBus()
+    worker.transport = MemoryTransport('test-memory')
+    worker.transport.start(worker.dispatch)
+    other_worker = InvalidationBus()
+    other_worker.transport = MemoryTransport('test-memory')
+    other_worker.transport.start(other_worker.dispatch)
+    other_worker.subscribe(lambda kind, key_id: received.append((kind, key_id)))
+
+    worker.publish(users=[1], roles=[2])
+
+    assert sorted(received) == [('role', 2), ('user', 1)]
+    worker.transport.stop()
+    other_worker.transport.stop()
+
+
+def test_unix_socket_transport_deliver_to_other_workers(tmpdir):
+    received = []
+    sender = UnixSocketTransport(str(tmpdir), name='sender')
+    sender.start(lambda keys: None)
+    receiver = UnixSocketTransport(str(tmpdir), name='receiver')
+    receiver.start(received.extend)
+
+    sender.send({('user', 7)})
+    for _ in range(100):
+        if received:
+            break
+        time.sleep(0.01)
+
+    assert received == [('user', 7)]
+    sender.stop()
+    receiver.stop()
+
+
+def test_committed_models_evict_cached_permissions(app, user, role, admin_role):
+    permission_cache.set(user.id, [(role.id, role.name)])
+    models_committed.send(app, changes=[(admin_role, 'insert')])
+    assert permission_cache.get(user.id) is None
+
+
+def test_transport_is_started_by_each_process(monkeypatch):
+    app = Flask('auth.main')
+    app.config.update(INVALIDATION_TRANSPORT='memory', INVALIDATION_CHANNEL='test-start')
+    bus = InvalidationBus(app)
+    assert bus.transport is None
+    bus.start()
+    transport = bus.transport
+    bus.start()
+    assert bus.transport is transport
+
+    # Same as a worker forked after app was created
+    monkeypatch.setattr(bus, '_pid', -1)
+    bus.start()
+    assert bus.transport is not transport
+    bus.transport.stop()
+    transport.stop()
+
+
+class BrokenConnection(object):
+    def get_backend_pid(self):
+        raise OSError('server closed the connection')
+
+    def close(self):
+        pass
+
+
+def test_postgres_transport_reconnects_and_resets(monkeypatch):
+    resets = []
+    transport = PostgresTransport('postgresql://')
+    transport.min_delay = 0
+    transport.running = True
+    transport.connection = BrokenConnection()
+    transport.reset = lambda: (resets.append(True), transport.stop())
+
+    def connect():
+        transport.connection = BrokenConnection()
+    monkeypatch.setattr(transport, '_connect', connect)
+    transport._listen()
+
+    assert resets == [True]
+    assert transport.connection is None
+
+
+def test_reset_forgets_cached_permissions(user, role):
+    bus = InvalidationBus()
+    bus.subscribe_reset(evict_all)
+    permission_cache.set(user.id, [(role.id, role.name)])
+    bus.reset()
+    assert permission_cache.get(user.id) is None
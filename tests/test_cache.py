@@ -0,0 +1,99 @@
+# coding: utf-8
+import time
+from auth.cache import PermissionCache, CountCache, permission_cache, count_cache, evict
+from auth.models import User, UserRole
+from auth.views import role_names
+
+
+def test_permission_cache_return_cached_names():
+    cache = PermissionCache(size=10, ttl=60)
+    cache.set(1, [(1, 'admin'), (2, 'user')])
+    assert cache.get(1) == frozenset(['admin', 'user'])
+    assert cache.get(2) is None
+
+
+def test_permission_cache_evict_least_recently_used():
+    cache = PermissionCache(size=2, ttl=60)
+    cache.set(1, [(1, 'admin')])
+    cache.set(2, [(1, 'admin')])
+    cache.get(1)
+    cache.set(3, [(2, 'user')])
+    assert cache.get(2) is None
+    assert cache.get(1) == frozenset(['admin'])
+    assert len(cache) == 2
+
+
+def test_permission_cache_expire_entries():
+    cache = PermissionCache(size=10, ttl=0.01)
+    cache.set(1, [(1, 'admin')])
+    time.sleep(0.02)
+    assert cache.get(1) is None
+
+
+def test_permission_cache_invalidate_only_users_of_role():
+    cache = PermissionCache(size=10, ttl=60)
+    cache.set(1, [(1, 'admin')])
+    cache.set(2, [(2, 'user')])
+    cache.invalidate_role(1)
+    assert cache.get(1) is None
+    assert cache.get(2) == frozenset(['user'])
+
+
+def test_disabled_permission_cache_keep_nothing():
+    cache = PermissionCache(size=0, ttl=60)
+    assert cache.set(1, [(1, 'admin')]) == frozenset(['admin'])
+    assert cache.get(1) is None
+
+
+def test_set_role_invalidate_cached_permissions(user, role, role_user, user_role):
+    assert role_names(user.id) == frozenset(['user'])
+    UserRole.set_role(user, role)
+    assert permission_cache.get(user.id) is None
+    assert role_names(user.id) == frozenset(['user', 'admin'])
+
+
+def test_edit_role_invalidate_cached_permissions(user, role_user, user_role):
+    assert role_names(user.id) == frozenset(['user'])
+    role_user.edit(name='reader')
+    assert role_names(user.id) == frozenset(['reader'])
+
+
+def test_cached_count_until_table_changes(user):
+    assert User.query.cached_count() == 1
+    # Changes not published in invalidation bus keep cached count
+    User.query.session.execute(User.__table__.insert().values(username='Han_Solo', email='han@sw.com'))
+    assert User.query.cached_count() == 1
+    assert User.query.fast_count() == 2
+
+    evict('user', user.id)
+    assert User.query.cached_count() == 2
+
+
+def test_cached_count_by_filter(user, other_user):
+    assert User.query.filter(User.username == 'Darth_Vader').cached_count() == 1
+    assert User.query.cached_count() == 2
+    assert len(count_cache) == 2
+    count_cache.invalidate('role')
+    assert len(count_cache) == 2
+    count_cache.invalidate('user')
+    assert len(count_cache) == 0
+
+
+def test_estimated_count_falls_back_to_exact_count(user):
+    assert User.query.estimated_count() == 1
+    assert User.query.count_by('estimated') == 1
+
+
+def test_cached_count_evicted_by_created_user(user):
+    assert User.query.cached_count() == 1
+    User.create(username='Han_Solo', email='han@sw.com', password='123456', confirm_password='123456')
+    assert User.query.cached_count() == 2
+
+
+def test_count_cache_keeps_a_fixed_number_of_counts():
+    cache = CountCache(size=2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get(key, ['user'], lambda: 1)
+    assert len(cache) == 2
+    assert cache.get('a', ['user'], lambda: 2) == 1
+    assert cache.get('b', ['user'], lambda: 2) == 2
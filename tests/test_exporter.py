@@ -0,0 +1,17 @@
+# coding: utf-8
+import json
+from auth.exporter import export_lines
+from auth.models import User
+
+
+def test_export_lines_iterates_all_rows_in_chunks(user, other_user):
+    lines = list(export_lines(User, chunk_size=1))
+    users = [json.loads(line) for line in lines]
+    assert [user['username'] for user in users] == ['Darth_Vader', 'Luke_Skywalker']
+    assert all(line.endswith('\n') for line in lines)
+    assert 'password' not in users[0]
+
+
+def test_export_lines_with_passwords(user):
+    users = [json.loads(line) for line in export_lines(User, exclude=())]
+    assert users[0]['password'] == user.password
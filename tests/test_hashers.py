@@ -0,0 +1,88 @@
+# coding: utf-8
+import json
+import pytest
+from flask import url_for
+from werkzeug.security import generate_password_hash
+from auth.exceptions import HashingUnavailable
+from auth.hashing import hashing_service
+from auth.hashers import create_hasher, check_password, is_password_hash
+
+
+@pytest.mark.parametrize('method, cost', [
+    ('pbkdf2:sha256', 1000),
+    ('pbkdf2:sha512', 1000),
+    ('scrypt', 2 ** 10),
+])
+def test_hasher_encode_and_check_password(method, cost):
+    encoded = create_hasher(method, cost).encode('12345678')
+    assert encoded.startswith(method)
+    assert check_password(encoded, '12345678') is True
+    assert check_password(encoded, '87654321') is False
+
+
+def test_check_password_made_by_werkzeug():
+    assert check_password(generate_password_hash('123456', 'pbkdf2:sha1:1000'), '123456') is True
+    assert check_password(generate_password_hash('123456', 'pbkdf2:sha256'), '123456') is True
+    assert check_password(None, '123456') is False
+
+
+def test_hasher_needs_update_outdated_hashes():
+    hasher = create_hasher('pbkdf2:sha256', 2000)
+    assert hasher.needs_update(create_hasher('pbkdf2:sha256', 1000).encode('123456')) is True
+    assert hasher.needs_update(create_hasher('scrypt', 2 ** 10).encode('123456')) is True
+    assert hasher.needs_update(hasher.encode('123456')) is False
+
+
+def test_hasher_keeps_hashes_of_a_slightly_lower_cost():
+    hasher = create_hasher('pbkdf2:sha256', 2000)
+    assert hasher.needs_update(create_hasher('pbkdf2:sha256', 1900).encode('123456')) is False
+    hasher = create_hasher('pbkdf2:sha256', 2000, tolerance=1)
+    assert hasher.needs_update(create_hasher('pbkdf2:sha256', 1900).encode('123456')) is True
+
+
+def test_calibrated_hasher_keeps_method():
+    hasher = create_hasher('pbkdf2:sha256', 10000, target=0.001)
+    assert hasher.method == 'pbkdf2:sha256'
+    assert hasher.cost % hasher.step == 0
+
+
+def test_unknown_hasher_raises_error():
+    with pytest.raises(ValueError):
+        create_hasher('md5')
+
+
+def test_login_upgrade_outdated_password_hash(user, header, client):
+    user.password = create_hasher('pbkdf2:sha256', 500).encode('12345678')
+    user.save()
+    response = client.post(url_for('core.login'),
+                           data=json.dumps({'username': 'Darth_Vader', 'password': '12345678'}),
+                           headers=header)
+    assert response.status_code == 200
+    assert user.password.startswith('pbkdf2:sha256:1000$')
+    assert user.validate_password('12345678') is True
+
+
+def test_login_when_password_hash_can_not_be_upgraded(user, header, client, monkeypatch):
+    def busy(password, lane=None):
+        raise HashingUnavailable
+    outdated = create_hasher('pbkdf2:sha256', 500).encode('12345678')
+    user.password = outdated
+    user.save()
+    monkeypatch.setattr(hashing_service, 'generate', busy)
+    response = client.post(url_for('core.login'),
+                           data=json.dumps({'username': 'Darth_Vader', 'password': '12345678'}),
+                           headers=header)
+    assert response.status_code == 200
+    assert user.password == outdated
+
+
+@pytest.mark.parametrize('encoded, expected', [
+    (create_hasher('scrypt', 1024).encode('123456'), True),
+    (generate_password_hash('123456'), True),
+    ('sha1$salt$hash', True),
+    ('123456', False),
+    ('plain$$123456', False),
+    ('$salt$hash', False),
+    ('unknown$salt$hash', False)])
+def test_is_password_hash(encoded, expected):
+    assert is_password_hash(encoded) is expected
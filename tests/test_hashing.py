@@ -0,0 +1,53 @@
+# coding: utf-8
+import time
+import pytest
+from flask import Flask
+from auth.exceptions import HashingUnavailable
+from auth.hashing import HashingService, Lane, BULK, INTERACTIVE
+
+
+@pytest.yield_fixture
+def service():
+    app = Flask('auth.main')
+    app.config.update(HASHING_WORKERS=1, HASHING_BULK_WORKERS=1, HASHING_QUEUE_DEPTH=2, HASHING_TIMEOUT=30)
+    service = HashingService(app)
+    yield service
+    service.shutdown()
+
+
+def test_hash_and_check_password_in_pool(service):
+    pwhash = service.generate('12345678')
+    assert service.check(pwhash, '12345678') is True
+    assert service.check(pwhash, '87654321') is False
+
+
+def test_generate_many_passwords_in_bulk_lane(service):
+    hashes = service.generate_many(['123456', '654321'])
+    assert service.check(hashes[0], '123456', lane=BULK) is True
+    assert service.check(hashes[1], '654321', lane=BULK) is True
+
+
+def test_full_lane_raises_error(service):
+    lane = service.lanes[INTERACTIVE]
+    lane.slots.acquire()
+    lane.slots.acquire()
+    try:
+        with pytest.raises(HashingUnavailable):
+            service.generate('12345678')
+        assert service.generate('12345678', lane=BULK)
+    finally:
+        lane.slots.release()
+        lane.slots.release()
+
+
+def test_timeout_of_batch_is_by_item():
+    lane = Lane(1, 1)
+    try:
+        assert lane.map(0.3, time.sleep, [0.1] * 6) == [None] * 6
+    finally:
+        lane.shutdown()
+
+
+def test_service_without_workers_hash_inline():
+    service = HashingService()
+    assert service.check(service.generate('123456'), '123456') is True
@@ -0,0 +1,62 @@
+# coding: utf-8
+import io
+import json
+from auth.bloom import login_filter
+from auth.exceptions import HashingUnavailable
+from auth.hashing import hashing_service
+from auth.importer import Importer, read_records, import_file, USERS, USER_ROLES
+from auth.models import User, UserRole
+
+
+def test_read_records_of_csv_and_ndjson():
+    csv_records = list(read_records(io.StringIO('username,role\nDarth_Vader,admin\n'), 'csv'))
+    ndjson_records = list(read_records(io.StringIO('{"username": "Darth_Vader", "role": "admin"}\n\n'), 'ndjson'))
+    assert csv_records == ndjson_records == [{'username': 'Darth_Vader', 'role': 'admin'}]
+
+
+PASSWORD_HASH = 'pbkdf2:sha256:1000$salt$hash'
+
+
+def test_import_users_in_chunks(user):
+    records = [{'username': 'user{}'.format(index), 'email': 'user{}@sw.com'.format(index),
+                'password': PASSWORD_HASH} for index in range(5)]
+    records += [{'username': 'Darth_Vader', 'email': 'other@sw.com', 'password': PASSWORD_HASH},
+                {'username': 'not valid', 'email': 'invalid@sw.com', 'password': PASSWORD_HASH},
+                {'username': 'nopassword', 'email': 'nopassword@sw.com'},
+                {'username': 'plaintext', 'email': 'plaintext@sw.com', 'password': '123456'}]
+    reports = []
+    progress = Importer(USERS, chunk_size=3, report=lambda progress: reports.append(progress.read)).run(records)
+
+    assert (progress.read, progress.imported, progress.skipped) == (9, 5, 3)
+    assert reports == [3, 6, 9]
+    assert User.query.filter_by(username='plaintext').count() == 0
+    assert User.query.filter(User.username.like('user%')).count() == 5
+    assert login_filter.might_contain('user4@sw.com')
+
+
+def test_import_users_hashing_passwords():
+    Importer(USERS, hash_passwords=True).run([{'username': 'Han_Solo', 'email': 'han@sw.com', 'password': '123456'}])
+    assert User.query.filter_by(username='Han_Solo').one().validate_password('123456')
+
+
+def test_import_users_hashing_passwords_when_lane_is_busy(monkeypatch):
+    def busy(passwords, lane):
+        raise HashingUnavailable
+    monkeypatch.setattr(hashing_service, 'generate_many', busy)
+    Importer(USERS, hash_passwords=True).run([{'username': 'Han_Solo', 'email': 'han@sw.com', 'password': '123456'}])
+    assert User.query.filter_by(username='Han_Solo').one().validate_password('123456')
+
+
+def test_import_user_roles_from_file(tmpdir, user, other_user, role, role_user):
+    path = tmpdir.join('user_roles.ndjson')
+    path.write('\n'.join(json.dumps(record) for record in [
+        {'username': 'Darth_Vader', 'role': 'admin'},
+        {'username': 'Luke_Skywalker', 'role': 'user'},
+        {'username': 'Luke_Skywalker', 'role': 'missing'},
+    ]))
+    version = other_user.roles_version
+    progress = import_file(str(path), USER_ROLES)
+
+    assert progress.imported == 2
+    assert UserRole.query.count() == 2
+    assert User.query.get(other_user.id).roles_version == version + 1
@@ -0,0 +1,30 @@
+# coding: utf-8
+from datetime import datetime
+from auth.models import User, Role
+from auth.serializers import serialize, serialize_list, serializer_for, format_datetime
+
+
+def test_format_datetime_as_strftime():
+    value = datetime(2016, 7, 3, 9, 5, 1)
+    assert format_datetime(value) == value.strftime('%d/%m/%Y %H:%M:%S')
+
+
+def test_serialize_user_without_password(user):
+    data = serialize(user)
+    assert data['username'] == 'Darth_Vader'
+    assert data['created_at'] == user.created_at.strftime('%d/%m/%Y %H:%M:%S')
+    assert 'password' not in data
+    assert list(data)[0] == 'id'
+
+
+def test_serializer_with_fields_keeps_order_of_table(user):
+    assert list(serialize(user, fields=['username', 'id'])) == ['id', 'username']
+    assert serialize(user, fields=['active']) == {'active': True}
+    assert serializer_for(User, ['id', 'username']) is serializer_for(User, ['username', 'id'])
+
+
+def test_serialize_list_of_many_models(user, role):
+    data = serialize_list([user, role])
+    assert data[0]['username'] == 'Darth_Vader'
+    assert data[1]['name'] == 'admin'
+    assert serializer_for(Role).fields[0] == 'id'
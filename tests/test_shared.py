@@ -0,0 +1,65 @@
+# coding: utf-8
+import pytest
+from auth.shared import SharedPermissionTable, SharedPermissions, shared_permissions
+from auth.views import has_permission
+
+
+@pytest.yield_fixture
+def table(tmpdir):
+    table = SharedPermissionTable(str(tmpdir.join('permissions')), capacity=64, words=1)
+    assert table.acquire() is True
+    yield table
+    table.close()
+
+
+def test_shared_table_return_mask_of_user(table):
+    table.rebuild([(0, 'admin'), (1, 'user')], [(1, 0, 0b11), (2, 3, 0b10)])
+    assert table.lookup(1, 0) == (0b11, {'admin': 0, 'user': 1})
+    assert table.lookup(2, 3)[0] == 0b10
+
+
+def test_shared_table_ignore_outdated_or_unknown_users(table):
+    table.rebuild([(0, 'admin')], [(1, 0, 0b1)])
+    assert table.lookup(1, 1) is None
+    assert table.lookup(5, 0) is None
+
+
+def test_shared_table_update_users_and_roles(table):
+    table.rebuild([(0, 'admin')], [(1, 0, 0b1)])
+    table.update_roles([(0, 'root'), (1, 'user')])
+    table.update_users([(1, 1, 0b10), (65, 0, 0b1)])
+    assert table.lookup(1, 1) == (0b10, {'root': 0, 'user': 1})
+    assert table.lookup(65, 0)[0] == 0b1
+
+
+def test_shared_table_has_a_single_writer(table):
+    other = SharedPermissionTable(table.path, capacity=64, words=1)
+    assert other.acquire() is False
+    other.close()
+
+
+def test_has_permission_read_shared_table(table, user, role, admin_role):
+    table.rebuild([(role.bit, role.name)], [(user.id, user.roles_version, 0)])
+    shared_permissions.table = table
+    try:
+        assert has_permission(user, frozenset(['admin'])) is False
+    finally:
+        shared_permissions.table = None
+
+
+def test_reader_does_not_keep_changes(table):
+    reader = SharedPermissions()
+    reader.table = SharedPermissionTable(table.path, capacity=64, words=1)
+    for user_id in range(1000):
+        reader.on_change('user', user_id)
+    assert reader._thread is None
+    assert reader._changes.qsize() == 0
+    reader.table.close()
+
+
+def test_shared_table_does_not_keep_users_above_max_load(table, caplog):
+    table.rebuild([(0, 'admin')], [(user_id, 0, 0b1) for user_id in range(1, 1001)])
+    assert table.count == int(table.capacity * table.max_load) + 1
+    assert table.overflow == 1000 - table.count
+    assert sum(table.lookup(user_id, 0) is not None for user_id in range(1, 1001)) == table.count
+    assert len([record for record in caplog.records if 'is full' in record.getMessage()]) == 1
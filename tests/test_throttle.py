@@ -0,0 +1,62 @@
+# coding: utf-8
+import json
+import pytest
+from flask import url_for
+from auth.throttle import MemoryBackend, LoginThrottled, login_throttle
+
+
+def test_memory_backend_refill_tokens():
+    backend = MemoryBackend()
+    assert backend.consume('user:vader', 1, 2, now=0) == 0
+    assert backend.consume('user:vader', 1, 2, now=0) == 0
+    assert backend.consume('user:vader', 1, 2, now=0) == 1
+    assert backend.consume('user:vader', 1, 2, now=1.5) == 0
+
+
+def test_memory_backend_keep_a_fixed_number_of_buckets():
+    backend = MemoryBackend(size=2)
+    for key in ('a', 'b', 'c'):
+        backend.consume(key, 1, 1, now=0)
+    assert len(backend._buckets) == 2
+    assert backend.consume('a', 1, 1, now=0) == 0
+
+
+@pytest.yield_fixture
+def throttle():
+    login_throttle.backend = MemoryBackend()
+    yield login_throttle
+    login_throttle.backend = None
+
+
+def test_throttle_raises_error_when_user_has_no_attempts(throttle):
+    for _ in range(5):
+        throttle.hit('Darth_Vader', '127.0.0.1')
+    with pytest.raises(LoginThrottled) as error:
+        throttle.hit('darth_vader', '127.0.0.2')
+    assert error.value.retry_after == 10
+
+
+def test_login_return_too_many_requests(throttle, user, header, client):
+    for _ in range(5):
+        client.post(url_for('core.login'), data=json.dumps({'username': 'Darth_Vader', 'password': 'wrong'}),
+                    headers=header)
+    response = client.post(url_for('core.login'),
+                           data=json.dumps({'username': 'Darth_Vader', 'password': '12345678'}), headers=header)
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['error_code'] == 'too_many_requests'
+    assert response.headers['Retry-After'] == '10'
+    assert response.status_code == 429
+
+
+def test_throttle_by_address_only_when_configured(throttle):
+    for index in range(40):
+        throttle.hit('user{}'.format(index), '10.0.0.1')
+
+    throttle.limits['address'] = (1, 2)
+    try:
+        throttle.hit('Han_Solo', '10.0.0.2')
+        throttle.hit('Leia', '10.0.0.2')
+        with pytest.raises(LoginThrottled):
+            throttle.hit('Chewbacca', '10.0.0.2')
+    finally:
+        del throttle.limits['address']
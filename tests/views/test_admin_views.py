@@ -2,6 +2,7 @@
 import json
 import pytest
 from flask import url_for
+from auth.models import Role
 
 
 def test_home_should_return_latest_values(client, admin_login):
@@ -237,6 +238,7 @@ def test_remove_all_users_of_role_with_success(client, admin_login, user, role_u
     response = client.delete(url_for('admin.remove_all_users', role_id=role_user.id))
     data = json.loads(response.data.decode('utf-8'))
     assert data['role']['users'] == []
+    assert data['removed'] == 1
     assert response.status_code == 202
 
 
@@ -244,4 +246,239 @@ def test_should_return_all_users_in_this_role(client, admin_login, user, role, o
     response = client.get(url_for('admin.show_role_users', role_id=role.id))
     data = json.loads(response.data.decode('utf-8'))
     assert data['users'][0]['username'] == 'Darth_Vader'
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+
+def test_create_users_in_batch(client, admin_login, header):
+    users = [{'username': 'Anakin', 'email': 'anakin@sw.com', 'password': '123456'},
+             {'username': 'Darth_Vader', 'email': 'vader@sw.com', 'password': '123456'},
+             {'username': 'Obi Wan', 'email': 'obiwan@sw.com', 'password': '123456'}]
+    response = client.post(url_for('admin.create_users'), data=json.dumps({'users': users}), headers=header)
+    data = json.loads(response.data.decode('utf-8'))
+    assert [result['status'] for result in data['results']] == ['created', 'conflict', 'invalid']
+    assert [result['index'] for result in data['results']] == [0, 1, 2]
+    assert (data['created'], data['conflict'], data['invalid']) == (1, 1, 1)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('body', [{}, {'users': []}, {'users': 'Anakin'}, {'users': ['Anakin']}])
+def test_create_users_in_batch_without_users(client, admin_login, header, body):
+    response = client.post(url_for('admin.create_users'), data=json.dumps(body), headers=header)
+    assert response.status_code == 400
+
+
+def test_export_users_as_ndjson(stream_client, admin_login, other_user):
+    response = stream_client.get(url_for('admin.export_users'))
+    users = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [user['username'] for user in users] == ['Darth_Vader', 'Luke_Skywalker']
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.status_code == 200
+
+
+def test_export_roles_as_ndjson(stream_client, admin_login):
+    response = stream_client.get(url_for('admin.export_roles'))
+    roles = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert [role['name'] for role in roles] == ['admin']
+    assert response.status_code == 200
+
+
+def test_users_paginated_by_cursor(client, admin_login):
+    from auth.models import User
+    for index in range(4):
+        User.create(username='user{}'.format(index), email='user{}@sw.com'.format(index), password='123456',
+                    confirm_password='123456')
+
+    response = client.get(url_for('admin.users', limit=2))
+    first = json.loads(response.data.decode('utf-8'))
+    response = client.get(url_for('admin.users', limit=2, after=first['next']))
+    second = json.loads(response.data.decode('utf-8'))
+    response = client.get(url_for('admin.users', limit=2, after=second['next']))
+    last = json.loads(response.data.decode('utf-8'))
+
+    usernames = [user['username'] for page in (first, second, last) for user in page['users']]
+    assert usernames == ['user3', 'user2', 'user1', 'user0', 'Darth_Vader']
+    assert last['next'] is None
+    assert first['total'] == 5
+
+
+def test_users_with_invalid_cursor(client, admin_login):
+    response = client.get(url_for('admin.users', after='not a cursor'))
+    assert response.status_code == 400
+
+
+def test_role_users_paginated_by_cursor(client, admin_login, role, other_user, other_user_in_role):
+    response = client.get(url_for('admin.show_role_users', role_id=role.id, limit=1))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['total'] == 2
+    assert [user['username'] for user in data['users']] == ['Darth_Vader']
+
+    response = client.get(url_for('admin.show_role_users', role_id=role.id, limit=1, after=data['next']))
+    data = json.loads(response.data.decode('utf-8'))
+    assert [user['username'] for user in data['users']] == ['Luke_Skywalker']
+    assert data['next'] is None
+
+
+def test_users_without_count(client, admin_login):
+    response = client.get(url_for('admin.users', count='false'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['total'] is None
+    assert len(data['users']) == 1
+
+
+def test_users_with_sparse_fields(client, admin_login):
+    response = client.get(url_for('admin.users', fields='username,active'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['users'] == [{'username': 'Darth_Vader', 'active': True}]
+
+
+def test_user_with_sparse_fields(client, admin_login, other_user):
+    response = client.get(url_for('admin.show_user', user_id=other_user.id, fields='id,username'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert sorted(data['user']) == ['id', 'roles', 'username']
+
+
+@pytest.mark.parametrize('fields', ['password', 'username,unknown', ','])
+def test_users_with_invalid_fields(client, admin_login, fields):
+    response = client.get(url_for('admin.users', fields=fields))
+    assert response.status_code == 400
+
+
+@pytest.yield_fixture
+def statements():
+    from sqlalchemy import event
+    from auth.main import db
+    executed = []
+
+    def count(conn, cursor, statement, *args):
+        executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def users_with_roles_statements(client, statements, prefix, total):
+    from auth.main import db
+    from auth.models import User, UserRole
+    for index in range(total):
+        user = User.create(username='{}{}'.format(prefix, index), email='{}{}@sw.com'.format(prefix, index),
+                           password='123456', confirm_password='123456')
+        UserRole.set_role(user, Role.query.filter_by(name='admin').one())
+    db.session.expire_all()
+    del statements[:]
+    response = client.get(url_for('admin.users', include='roles', limit=100))
+    return json.loads(response.data.decode('utf-8')), len(statements)
+
+
+def test_users_include_roles_with_constant_queries(client, admin_login, statements):
+    # First request also loads caches of permissions
+    users_with_roles_statements(client, statements, 'first', 1)
+    data, few = users_with_roles_statements(client, statements, 'few', 2)
+    assert data['users'][0]['roles'][0]['name'] == 'admin'
+    _, many = users_with_roles_statements(client, statements, 'many', 6)
+    assert few == many
+
+
+def test_roles_include_users(client, admin_login):
+    response = client.get(url_for('admin.roles', include='users'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['roles'][0]['users'][0]['username'] == 'Darth_Vader'
+
+    response = client.get(url_for('admin.roles', include='roles'))
+    assert response.status_code == 400
+
+
+def test_role_with_a_page_of_users(client, admin_login, role, other_user, other_user_in_role):
+    response = client.get(url_for('admin.show_role', role_id=role.id, limit=1, fields='id,name'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert sorted(data['role']) == ['id', 'name', 'users', 'users_next', 'users_total']
+    assert [user['username'] for user in data['role']['users']] == ['Darth_Vader']
+    assert data['role']['users_total'] == 2
+
+    response = client.get(url_for('admin.show_role_users', role_id=role.id, after=data['role']['users_next']))
+    data = json.loads(response.data.decode('utf-8'))
+    assert [user['username'] for user in data['users']] == ['Luke_Skywalker']
+
+
+def test_assign_and_revoke_role_of_users(client, admin_login, header, user, other_user, role_writer):
+    from auth.models import UserRole
+    body = json.dumps({'user_ids': [user.id, other_user.id, 1000]})
+    response = client.post(url_for('admin.assign_role_users', role_id=role_writer.id), data=body, headers=header)
+    data = json.loads(response.data.decode('utf-8'))
+    assert (data['inserted'], data['missing']) == (2, [1000])
+    assert response.status_code == 201
+
+    response = client.post(url_for('admin.assign_role_users', role_id=role_writer.id), data=body, headers=header)
+    assert json.loads(response.data.decode('utf-8'))['inserted'] == 0
+    assert UserRole.query.filter_by(role_id=role_writer.id).count() == 2
+
+    body = json.dumps({'user_ids': [other_user.id]})
+    response = client.delete(url_for('admin.revoke_role_users', role_id=role_writer.id), data=body, headers=header)
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['removed'] == 1
+    assert response.status_code == 202
+    assert [role_user.user_id for role_user in UserRole.query.filter_by(role_id=role_writer.id)] == [user.id]
+
+
+@pytest.mark.parametrize('body', [{}, {'user_ids': []}, {'user_ids': ['1']}, {'user_ids': 1}])
+def test_assign_role_of_users_without_ids(client, admin_login, header, role_writer, body):
+    response = client.post(url_for('admin.assign_role_users', role_id=role_writer.id), data=json.dumps(body),
+                           headers=header)
+    assert response.status_code == 400
+
+
+def test_set_status_of_users_by_ids_and_filter(client, admin_login, header, user, other_user):
+    from auth.models import User
+    body = json.dumps({'active': False, 'user_ids': [other_user.id]})
+    response = client.post(url_for('admin.set_users_status'), data=body, headers=header)
+    assert json.loads(response.data.decode('utf-8'))['updated'] == 1
+    assert response.status_code == 202
+    assert User.query.get(other_user.id).active is False
+
+    body = json.dumps({'active': False, 'filter': {'email_domain': 'bewith.you'}})
+    response = client.post(url_for('admin.set_users_status'), data=body, headers=header)
+    assert json.loads(response.data.decode('utf-8'))['updated'] == 1
+    assert User.query.get(user.id).active is False
+
+
+@pytest.mark.parametrize('body', [{'user_ids': [1]}, {'active': 'no', 'user_ids': [1]}, {'active': True},
+                                  {'active': True, 'filter': {'email': 'x'}}])
+def test_set_status_of_users_without_success(client, admin_login, header, body):
+    response = client.post(url_for('admin.set_users_status'), data=json.dumps(body), headers=header)
+    assert response.status_code == 400
+
+
+def test_delete_users_with_memberships(client, admin_login, header, other_user, other_user_in_role):
+    from auth.models import User, UserRole
+    body = json.dumps({'user_ids': [other_user.id]})
+    response = client.delete(url_for('admin.delete_users'), data=body, headers=header)
+    data = json.loads(response.data.decode('utf-8'))
+    assert (data['deleted'], data['removed']) == (1, 1)
+    assert User.query.filter_by(username='Luke_Skywalker').count() == 0
+    assert UserRole.query.filter_by(user_id=other_user.id).count() == 0
+
+
+def test_patch_user_with_etag(client, admin_login, header, other_user):
+    body = json.dumps({'username': 'Luke', 'active': False})
+    response = client.patch(url_for('admin.patch_user', user_id=other_user.id), data=body,
+                            headers=dict(header, **{'If-Match': '"0"'}))
+    data = json.loads(response.data.decode('utf-8'))
+    assert (data['user']['username'], data['user']['active']) == ('Luke', False)
+    assert 'password' not in data['user']
+    assert response.headers['ETag'] == '"1"'
+
+    response = client.patch(url_for('admin.patch_user', user_id=other_user.id), data=body,
+                            headers=dict(header, **{'If-Match': '"0"'}))
+    assert json.loads(response.data.decode('utf-8'))['error_code'] == 'precondition_failed'
+    assert response.status_code == 412
+
+
+@pytest.mark.parametrize('status_code, role_id, body', [
+    (400, None, {'bit': 1}),
+    (400, None, {}),
+    (400, None, {'active': 1}),
+    (409, None, {'name': 'admin'}),
+    (404, 100, {'name': 'other'})])
+def test_patch_role_without_success(client, admin_login, header, role, role_writer, status_code, role_id, body):
+    response = client.patch(url_for('admin.patch_role', role_id=role_id or role_writer.id), data=json.dumps(body),
+                            headers=header)
+    assert response.status_code == status_code
@@ -122,3 +122,40 @@ def test_logout_is_a_success(login, user, client):
     assert data['message'] == 'success'
     assert current_user.is_authenticated is False
 
+
+def test_access_a_blocked_page_by_inactive_role_without_success(login, user, client, role_user, user_role):
+    role_user.toggle_status()
+    response = client.get(url_for('core.user_view'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['error_code'] == 'forbidden'
+    assert response.status_code == 403
+
+
+def test_access_a_blocked_page_by_role_without_permission_cache(app, login, user, client, user_role):
+    from auth.cache import permission_cache
+    ttl, permission_cache.ttl = permission_cache.ttl, 0
+    app.config['PERMISSION_SESSION_MASK'] = False
+    try:
+        response = client.get(url_for('core.user_view'))
+    finally:
+        permission_cache.ttl = ttl
+        app.config['PERMISSION_SESSION_MASK'] = True
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('status_code, username, available', [
+    (200, 'Darth_Vader', False),
+    (200, 'Luke_Skywalker', True),
+])
+def test_username_available(user, client, status_code, username, available):
+    response = client.get(url_for('core.username_available', username=username))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['available'] is available
+    assert response.status_code == status_code
+
+
+def test_username_available_with_invalid_username(client):
+    response = client.get(url_for('core.username_available', username='a@'))
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['error_code'] == 'bad_request'
+    assert response.status_code == 400
@@ -0,0 +1,45 @@
+# coding: utf-8
+import pytest
+from auth.cache import permission_cache
+from auth.views import has_permission, login_permission
+
+
+@pytest.yield_fixture(params=['session', 'cached', 'uncached'])
+def strategy(request, app):
+    ttl = permission_cache.ttl
+    app.config['PERMISSION_SESSION_MASK'] = request.param == 'session'
+    if request.param == 'uncached':
+        permission_cache.ttl = 0
+    yield request.param
+    permission_cache.ttl = ttl
+    app.config['PERMISSION_SESSION_MASK'] = True
+
+
+@pytest.mark.parametrize('permissions, mode, expected', [
+    (['admin'], 'any', True),
+    (['admin', 'support'], 'any', True),
+    (['support', 'billing'], 'any', False),
+    (['admin', 'user'], 'all', True),
+    (['admin', 'support'], 'all', False),
+])
+def test_has_permission_with_mode(strategy, user, admin_role, user_role, permissions, mode, expected):
+    assert has_permission(user, frozenset(permissions), mode) is expected
+
+
+def test_login_permission_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        login_permission('admin', mode='some')
+
+
+def test_session_mask_is_refreshed_when_memberships_change(user, role, role_user, user_role):
+    from flask import session
+    from auth.models import UserRole
+    assert has_permission(user, frozenset(['admin'])) is False
+    version = session['roles']['version']
+    UserRole.set_role(user, role)
+    assert user.roles_version == version + 1
+    assert has_permission(user, frozenset(['admin'])) is True
+
+
+def test_roles_get_distinct_bit_slots(role, role_user, role_writer):
+    assert sorted([role.bit, role_user.bit, role_writer.bit]) == [0, 1, 2]